@@ -1,11 +1,14 @@
 import copy
+import hashlib
 import json
 import os
 import os.path
-import subprocess
+import tempfile
 from datetime import datetime
 
 from models import Configlet, Configuration
+from template import get_compiled_configlet
+from script_worker import ScriptError, get_script_worker_pool
 from pool.pool import generate_pool_value
 from fabric.fabric_rule import generate_instance_value
 
@@ -14,17 +17,20 @@ logger = logging.getLogger(__name__)
 
 BASE_PATH = os.getcwd() + '/repo/'
 
+# script configlets run in warm interpreters, killed after SCRIPT_TIMEOUT seconds
+SCRIPT_WORKERS = 4
+SCRIPT_TIMEOUT = 30
 
-def build_config(cfg_id, fabric_id, switch_name):
+# mkstemp creates files 0600, switches scp their config as an unprivileged user
+CONFIG_FILE_MODE = 0644
+
+
+def build_config(match_ctx, cfg_id, fabric_id, switch_name):
     file_name = switch_name + '.cfg'
     file_path = BASE_PATH + file_name
 
     logger.debug("File path = " + file_path)
 
-    if os.path.isfile(file_path):
-        logger.debug("Config file already exists!")
-        #return file_name
-
     try:
         cfg = Configuration.objects.get(pk=cfg_id)
     except Configuration.DoesNotExist:
@@ -35,17 +41,66 @@ def build_config(cfg_id, fabric_id, switch_name):
         logger.error("Config ID" + str(cfg_id) + " is not ready for use")
         return None
 
+    construct_list = cfg.construct_list
+
+    # configlet id -> (Configlet, CompiledConfiglet)
+    configlets = {}
+    for construct in construct_list:
+        cfglt_id = construct['configlet_id']
+        if cfglt_id not in configlets:
+            configlets[cfglt_id] = get_compiled_configlet(cfglt_id)
+            if configlets[cfglt_id][0] is None:
+                logger.error("Invalid Configlet ID = " + str(cfglt_id))
+                return None
+
+    manifest = read_build_manifest(switch_name)
+    construct_values = resolve_params(match_ctx, construct_list, fabric_id, switch_name, manifest.get('params'))
+    if construct_values is None:
+        return None
+
+    build_hash = build_input_hash(match_ctx, cfg, fabric_id, switch_name, configlets, construct_values)
+    if os.path.isfile(file_path) and manifest.get('hash') == build_hash:
+        logger.debug("Config file already exists and is up to date!")
+        return file_name
+
     logger.debug("Building Config, Config ID = " + str(cfg_id) + " Fabric ID = "
                 + str(fabric_id) + " Switch Name = " + switch_name)
 
+    # generate into a private temp file so a half built config is never served
+    tmp_fd, tmp_path = tempfile.mkstemp(prefix='.' + file_name + '_', dir=BASE_PATH)
+    os.fchmod(tmp_fd, CONFIG_FILE_MODE)
+    fh = os.fdopen(tmp_fd, 'w')
+
+    for construct, param_values in zip(construct_list, construct_values):
+        cfglt_id = construct['configlet_id']
+        cfglt, compiled = configlets[cfglt_id]
+        if not expand_configlet(fh, cfglt, compiled, param_values):
+            logger.error("Failed to expand Configlet ID = " + str(cfglt_id))
+            fh.close()
+            os.remove(tmp_path)
+            return None
+
+    fh.close()
+    os.rename(tmp_path, file_path)
+    write_build_manifest(switch_name, build_hash, construct_values)
+
+    return file_name
+
+
+# Param values of each construct in construct_list, as its configlet sees
+# them. built_values are the ones of the last build, see write_build_manifest:
+# fabric pools hand out a new value on every call, so a value the switch
+# still holds is kept instead of taking another one.
+def resolve_params(match_ctx, construct_list, fabric_id, switch_name, built_values):
+    if not isinstance(built_values, list) or len(built_values) != len(construct_list):
+        built_values = [{}] * len(construct_list)
+
     # params need to be stored across configlets
     param_values = {}
+    construct_values = []
 
-    fh = open(file_path, 'w')
-
-    for construct in json.loads(cfg.construct_list):
-        cfglt_id = construct['configlet_id']
-        logger.debug("Configlet ID = " + str(cfglt_id))
+    for construct, built in zip(construct_list, built_values):
+        logger.debug("Configlet ID = " + str(construct['configlet_id']))
 
         for param in construct['param_list']:
             logger.debug("Param (Name, Type, Value) = (" + param['param_name']
@@ -57,77 +112,105 @@ def build_config(cfg_id, fabric_id, switch_name):
             elif param['param_type'] == 'Value':
                 param_values[param['param_name']] = param_values[param['param_value']]
             elif param['param_type'] == 'Instance':
-                val = generate_instance_value(param['param_value'], fabric_id, switch_name)
+                val = generate_instance_value(match_ctx, param['param_value'], fabric_id, switch_name)
 
                 if val == None:
                     logger.error("Instance returned NULL value")
-                    os.remove(file_path)
                     return None
 
                 logger.debug("Instance value = " + val)
 
                 param_values[param['param_name']] = val
             elif param['param_type'] == 'Pool':
-                val = generate_pool_value(param['param_value'], fabric_id, switch_name)
+                val = generate_pool_value(param['param_value'], fabric_id, switch_name,
+                                          keep_value=built.get(param['param_name']))
 
                 if val == None:
                     logger.error("Pool returned NULL value")
-                    os.remove(file_path)
                     return None
 
                 param_values[param['param_name']] = val
             elif param['param_type'] == 'Autogenerate':
                 param_values[param['param_name']] = auto_generate_value(param['param_value'])
-                
 
-        if not expand_configlet(fh, cfglt_id, param_values):
-            logger.error("Invalid Configlet ID = " + str(cfglt_id))
-            os.remove(file_path)
-            return None
+        construct_values.append(dict(param_values))
 
-    return file_name
+    return construct_values
+
+
+# Hash of everything a switch config is generated from, the resolved param
+# values included, so an edited pool range or a freed or reassigned pool
+# value builds the config again
+def build_input_hash(match_ctx, cfg, fabric_id, switch_name, configlets, construct_values):
+    topology_version = None
+    if match_ctx.topology is not None:
+        topology_version = [match_ctx.topology.version[0], str(match_ctx.topology.version[1])]
+
+    configlet_versions = []
+    for cfglt, compiled in configlets.values():
+        configlet_versions.append([cfglt.id, cfglt.config_type, compiled.version[1]])
+    configlet_versions.sort()
+
+    inputs = {
+        'cfg_id': cfg.id,
+        'construct_list': cfg.construct_list,
+        'configlets': configlet_versions,
+        'topology': topology_version,
+        'fabric_id': fabric_id,
+        'switch_name': switch_name,
+        'params': construct_values,
+    }
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
 
-def expand_configlet(fh, cfglt_id, param_values):
+
+def manifest_path(switch_name):
+    return BASE_PATH + "." + switch_name + ".manifest"
+
+
+def read_build_manifest(switch_name):
     try:
-        cfglt = Configlet.objects.get(pk=cfglt_id)
-    except Configlet.DoesNotExist:
-        return False
+        with open(manifest_path(switch_name)) as manifest_fh:
+            return json.load(manifest_fh)
+    except (IOError, ValueError):
+        return {}
+
 
+def write_build_manifest(switch_name, build_hash, construct_values):
+    manifest = {
+        'hash': build_hash,
+        'params': construct_values,
+        'built': str(datetime.now()),
+    }
+    with open(manifest_path(switch_name), 'w') as manifest_fh:
+        json.dump(manifest, manifest_fh)
+
+
+def expand_configlet(fh, cfglt, compiled, param_values):
     cfglt_type = cfglt.config_type
 
     logger.debug("Configlet type  = " + cfglt_type)
     logger.debug("Configlet path  = " + str(cfglt.config_path))
 
-    if cfglt_type == 'script':
-        dt = datetime.now() 
-        script_path = BASE_PATH + "." +  cfglt.name +"_" + str(dt.microsecond) + ".py"
-        logger.debug("Temp script name = " + script_path)
-        script_fh = open(script_path, "w")
-
     # write a comment about upcoming config
     fh.write("!\n! " + cfglt.name + " config\n!\n")
     fh.flush()
-    logger.debug("Expanded Configlet =")
-
-    for line in cfglt.config_path.file:
-        for key, value in param_values.iteritems():
-            #logger.debug("(key, value) = (" + key + ", " + value + ")")
-            #replace param with values
-            line = line.replace('$$' + key + '$$', value)
-        logger.debug(line)
-        
-        if cfglt_type == 'template':
-            # write to config file
-            fh.write(line)
-        elif cfglt_type == 'script':
-            # write to temp script file
-            script_fh.write(line)
-
-    if cfglt_type == 'script':
-        # execute script & write output to config file
-        proc = subprocess.Popen(['python', script_path], stdout=fh)
-
-        #os.remove(script_path)
+
+    # replace params with values
+    body = compiled.render(param_values)
+    logger.debug("Expanded Configlet =\n" + body)
+
+    if cfglt_type == 'template':
+        # write to config file
+        fh.write(body)
+    elif cfglt_type == 'script':
+        # run script in a worker & write its output to config file
+        pool = get_script_worker_pool(SCRIPT_WORKERS)
+        try:
+            output = pool.run(cfglt.name, body, SCRIPT_TIMEOUT)
+        except ScriptError, e:
+            logger.error("Script configlet " + cfglt.name + " failed: " + str(e))
+            return False
+        fh.write(output)
 
     return True
 
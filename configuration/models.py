@@ -3,6 +3,7 @@ __author__  = "Rohit N Dubey"
 
 
 from django.db import models
+from usermanagement.fields import JSONField
 from django.contrib.auth.models import User
 
 # Create your models here.
@@ -29,7 +30,7 @@ class Configuration(models.Model):
     submit = models.CharField(max_length=10, default="false")
     referenced = models.IntegerField(null=True,blank=True,default=0)
     installed =  models.IntegerField(null=True,blank=True,default=0)
-    construct_list = models.TextField()
+    construct_list = JSONField()
     status = models.BooleanField(default=True)
     last_modified_by = models.ForeignKey(User)
     created_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
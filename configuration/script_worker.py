@@ -0,0 +1,231 @@
+__author__  = "Rohit N Dubey"
+
+'''
+Warm python interpreters for script type configlets.
+
+Imported by config.py for ScriptWorkerPool, and run as a program by every
+worker process. Only the standard library is used here so the worker does
+not need Django on its path.
+
+A worker forks a child per script with fd 1 on a temp file, as the script
+used to run with its own process and stdout: output of subprocesses and
+os.system is captured along with print, and nothing the script changes
+outlives it.
+
+Messages on the worker pipes are a 4 byte big endian length followed by a
+JSON object: {"name", "script"} to the worker, {"output", "error"} back.
+output is the script's bytes decoded as latin-1 so they survive JSON as is.
+'''
+
+import json
+import os
+import select
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+WORKER_PATH = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+HEADER = struct.Struct('>I')
+
+
+# a script run failed, see ScriptFailed for failures of the script itself
+class ScriptError(Exception):
+    pass
+
+
+# the script raised or exited non zero, its worker is fine to reuse
+class ScriptFailed(ScriptError):
+    pass
+
+
+def write_message(fh, message):
+    data = json.dumps(message)
+    fh.write(HEADER.pack(len(data)) + data)
+    fh.flush()
+
+
+def read_message(fh):
+    header = fh.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    return json.loads(fh.read(length))
+
+
+def read_exact(fd, length, deadline):
+    data = ''
+    while len(data) < length:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ScriptError("timed out")
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            raise ScriptError("timed out")
+        chunk = os.read(fd, length - len(data))
+        if not chunk:
+            raise ScriptError("worker exited")
+        data += chunk
+    return data
+
+
+class ScriptWorker(object):
+
+    def __init__(self, interpreter):
+        # own session, so kill() also takes the script and what it started
+        self.proc = subprocess.Popen([interpreter, WORKER_PATH], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+
+    def run(self, name, script, timeout):
+        deadline = time.time() + timeout
+        try:
+            write_message(self.proc.stdin, {'name': name, 'script': script})
+        except (IOError, OSError), e:
+            raise ScriptError("worker exited: " + str(e))
+        fd = self.proc.stdout.fileno()
+        (length,) = HEADER.unpack(read_exact(fd, HEADER.size, deadline))
+        reply = json.loads(read_exact(fd, length, deadline))
+        if reply['error']:
+            raise ScriptFailed(reply['error'])
+        return reply['output'].encode('latin-1')
+
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        try:
+            self.proc.wait()
+        except OSError:
+            pass
+
+
+class ScriptWorkerPool(object):
+    '''
+    Fixed number of worker processes started up front and reused across
+    requests. A worker that times out or breaks the protocol is killed and
+    replaced; one that can't be started is retried on the next run.
+    Waiting for a free worker is bounded by the script timeout too.
+    '''
+    def __init__(self, size, interpreter='python'):
+        self.interpreter = interpreter
+        self.idle = Queue.Queue()
+        self.missing = 0
+        self.lock = threading.Lock()
+        for index in range(size):
+            self.idle.put(ScriptWorker(interpreter))
+
+    def start_worker(self):
+        try:
+            worker = ScriptWorker(self.interpreter)
+        except OSError, e:
+            logger.error("Failed to start a script worker: " + str(e))
+            with self.lock:
+                self.missing += 1
+            return
+        self.idle.put(worker)
+
+    def run(self, name, script, timeout):
+        with self.lock:
+            missing = self.missing
+            self.missing = 0
+        for index in range(missing):
+            self.start_worker()
+
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except Queue.Empty:
+            raise ScriptError("no script worker free after " + str(timeout) + " seconds")
+        try:
+            return worker.run(name, script, timeout)
+        except ScriptFailed:
+            raise
+        except:
+            # a reply may be half read, the worker can't be trusted anymore
+            worker.kill()
+            worker = None
+            self.start_worker()
+            raise
+        finally:
+            if worker is not None:
+                self.idle.put(worker)
+
+
+script_worker_pool = None
+script_worker_pool_lock = threading.Lock()
+
+
+def get_script_worker_pool(size, interpreter='python'):
+    global script_worker_pool
+    with script_worker_pool_lock:
+        if script_worker_pool is None:
+            script_worker_pool = ScriptWorkerPool(size, interpreter)
+            logger.debug("Started " + str(size) + " script workers")
+    return script_worker_pool
+
+
+def worker_main():
+    # keep the real pipes for messages and point fd 0/1 at /dev/null so
+    # nothing a script does with them can corrupt the protocol
+    proto_in = os.fdopen(os.dup(0), 'rb')
+    proto_out = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    while True:
+        request = read_message(proto_in)
+        if request is None:
+            break
+        output, error = run_script(request, [proto_in, proto_out])
+        write_message(proto_out, {'output': output.decode('latin-1'),
+                                  'error': error.decode('utf-8', 'replace') if error else None})
+
+
+def run_script(request, proto_files):
+    output_fh = tempfile.TemporaryFile()
+    error_fh = tempfile.TemporaryFile()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for fh in proto_files:
+                os.close(fh.fileno())
+            os.dup2(output_fh.fileno(), 1)
+            sys.stdout = os.fdopen(1, 'w')
+            try:
+                code = compile(request['script'], request['name'], 'exec')
+                exec(code, {'__name__': '__main__'})
+            except SystemExit, e:
+                if e.code not in (None, 0):
+                    error_fh.write("exit status " + str(e.code))
+            except:
+                error_fh.write(traceback.format_exc())
+            sys.stdout.flush()
+            error_fh.flush()
+        finally:
+            os._exit(0)
+
+    _, status = os.waitpid(pid, 0)
+    output_fh.seek(0)
+    error_fh.seek(0)
+    output = output_fh.read()
+    error = error_fh.read()
+    output_fh.close()
+    error_fh.close()
+    if not error and os.WIFSIGNALED(status):
+        error = "killed by signal " + str(os.WTERMSIG(status))
+    elif not error and os.WEXITSTATUS(status):
+        error = "exit status " + str(os.WEXITSTATUS(status))
+    return output, error
+
+
+if __name__ == '__main__':
+    worker_main()
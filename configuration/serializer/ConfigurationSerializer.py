@@ -4,6 +4,7 @@ __author__  = "Rohit N Dubey"
 from rest_framework import serializers
 from configuration.models import Configuration
 from rest_framework.validators import UniqueValidator
+from usermanagement.utils import LocalDateTimeField
 import re
 
 PARAM_TYPE_CHOICES = [ 'Fixed', 'Instance', 'Pool', 'Value', 'Autogenerate' ]
@@ -59,3 +60,9 @@ class ConfigurationGetSerializer(serializers.Serializer):
     construct_list = JSONSerializerField()
     created_date = serializers.DateTimeField()
     updated_date = serializers.DateTimeField()
+
+
+class ConfigurationListSerializer(ConfigurationGetSerializer):
+
+    created_date = LocalDateTimeField()
+    updated_date = LocalDateTimeField()
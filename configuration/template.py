@@ -0,0 +1,60 @@
+__author__  = "Rohit N Dubey"
+
+import os
+import threading
+
+from models import Configlet
+from usermanagement.utils import PARAM_REGEX
+
+import logging
+logger = logging.getLogger(__name__)
+
+# configlet id -> CompiledConfiglet, replaced when the file's mtime changes
+compiled_configlets = {}
+compiled_configlets_lock = threading.Lock()
+
+
+class CompiledConfiglet(object):
+    '''
+    Configlet body split once into literal text and $$name$$ placeholders.
+    segments alternate literal, param name, literal, ... as returned by
+    PARAM_REGEX.split, so every odd index is a parameter name.
+    '''
+    def __init__(self, cfglt, mtime):
+        self.version = (cfglt.id, mtime)
+
+        cfglt.config_path.open('r')
+        try:
+            body = cfglt.config_path.read()
+        finally:
+            cfglt.config_path.close()
+        self.segments = PARAM_REGEX.split(body)
+
+    def render(self, param_values):
+        parts = list(self.segments)
+        for index in range(1, len(parts), 2):
+            name = parts[index]
+            if name in param_values:
+                parts[index] = param_values[name]
+            else:
+                # unknown params are left in place, as str.replace did
+                parts[index] = '$$' + name + '$$'
+        return ''.join(parts)
+
+
+# returns (Configlet, CompiledConfiglet) or (None, None) for an unknown id
+def get_compiled_configlet(cfglt_id):
+    try:
+        cfglt = Configlet.objects.get(pk=cfglt_id)
+    except Configlet.DoesNotExist:
+        return None, None
+
+    mtime = os.path.getmtime(cfglt.config_path.path)
+    compiled = compiled_configlets.get(cfglt.id)
+    if compiled is None or compiled.version != (cfglt.id, mtime):
+        compiled = CompiledConfiglet(cfglt, mtime)
+        with compiled_configlets_lock:
+            compiled_configlets[cfglt.id] = compiled
+        logger.debug("Compiled configlet " + cfglt.name + " with "
+                    + str(len(compiled.segments) // 2) + " placeholders")
+    return cfglt, compiled
@@ -12,9 +12,9 @@ from models import Configlet,Configuration
 import json
 from serializer.ConfigletSerializer import ConfigletSerializer, ConfigletGetSerializer
 from serializer.ConfigurationSerializer import ConfigurationSerializer, \
-    ConfigurationGetSerializer,ConfigurationPutSerializer
+    ConfigurationGetSerializer,ConfigurationPutSerializer,ConfigurationListSerializer
 from django.http import HttpResponse, Http404
-from usermanagement.utils import RequestValidator,parse_file,change_datetime
+from usermanagement.utils import RequestValidator,parse_file,get_cached_token,ListRequest
 from django.http import HttpResponse
 from django.http import JsonResponse
 from django.contrib.auth.models import User
@@ -39,17 +39,18 @@ class ConfigletList(APIView,RequestValidator):
 
     def get(self, request, format=None):
 
-        configlets = Configlet.objects.filter(status = True).order_by('name')
+        list_request = ListRequest(request, ('name', 'id'))
+        configlets = list_request.page(list_request.defer(Configlet.objects.filter(status = True)
+                                                          .order_by('name', 'id'), 'parameters'))
         logger.debug("Total configlets fetched from database: "+str(len(configlets)))
-        serializer = ConfigletGetSerializer(configlets, many=True)
+        serializer = list_request.serializer(ConfigletGetSerializer(configlets, many=True))
         for cfglt_detail in serializer.data:
             try :
                 cfglt_detail['parameters'] = json.loads(cfglt_detail['parameters'])
             except:
                 pass
         conf = serializer.data
-	conf = change_datetime(conf)
-        return Response(conf)
+        return list_request.response(conf)
 
     def post(self, request, format=None):
         serializer = ConfigletSerializer(data=request.data)
@@ -123,17 +124,13 @@ class ConfigletDetail(APIView,RequestValidator):
 
 
 def get_user_by_token(tkn):
-    try:
-        obj = Token.objects.get(pk=tkn)
-    except:
+    # token and user come from the cache dispatch() already filled
+    obj = get_cached_token(tkn)
+    if obj is None:
         logger.debug("Failed to find token = " + tkn + " in Token table")
         return False, None
 
-    try:
-        user = User.objects.get(pk=obj.user_id)
-    except:
-        logger.debug("Failed to find user = " + str(obj.user_id) + " in Token table")
-        return False, None
+    user = obj.user
 
     logger.debug("User name = " + user.username)
 
@@ -153,19 +150,18 @@ class ConfigurationList(APIView,RequestValidator):
 
 
     def get(self, request, format=None):
-        configuration = Configuration.objects.filter(status = True).order_by('name')
-        serializer = ConfigurationGetSerializer(configuration, many=True)
-        index = 0
-        for config_details in serializer.data:
+        list_request = ListRequest(request, ('name', 'id'))
+        configuration = Configuration.objects.filter(status = True).order_by('name', 'id')\
+                        .select_related('last_modified_by')
+        configuration = list_request.page(list_request.defer(configuration, 'construct_list'))
+        serializer = list_request.serializer(ConfigurationListSerializer(configuration, many=True))
+        for config_obj, config_details in zip(configuration, serializer.data):
             try:
-                config_details['construct_list'] = json.loads(config_details['construct_list'])
-                config_details['last_modified_by'] = configuration[index].last_modified_by.username
+                config_details['last_modified_by'] = config_obj.last_modified_by.username
             except:pass
-            index += 1
         conf = serializer.data
-        conf = change_datetime(conf)
 
-        return Response(conf)
+        return list_request.response(conf)
 
     def post(self, request, format=None):
         try:
@@ -191,7 +187,6 @@ class ConfigurationList(APIView,RequestValidator):
             logger.debug("Configuration created successfully")
             serializer = ConfigurationGetSerializer(config_obj)
             config_details = serializer.data
-            config_details['construct_list'] =  json.loads(config_details['construct_list'])
             return Response(config_details, status=status.HTTP_201_CREATED)
         logger.error("Invalid Json  ")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -221,7 +216,6 @@ class ConfigurationDetail(APIView,RequestValidator):
         configuration = self.get_object(id)
         serializer = ConfigurationGetSerializer(configuration)
         config_details = serializer.data
-        config_details['construct_list'] =  json.loads(config_details['construct_list'])
         config_details['last_modified_by'] = configuration.last_modified_by.username
         return Response(config_details)
 
@@ -240,7 +234,6 @@ class ConfigurationDetail(APIView,RequestValidator):
             config_obj.save()
             serializer = ConfigurationGetSerializer(config_obj)
             resp = serializer.data
-            resp['construct_list'] = json.loads(resp['construct_list'])
             logger.debug("Configuration record updated successfully for id :"+str(id))
             return Response(resp)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
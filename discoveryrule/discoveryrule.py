@@ -5,12 +5,15 @@ from rest_framework.views import APIView
 from django.views.generic.base import View
 from rest_framework.response import Response
 from rest_framework import status
-import ast
-import json
 import re
 import logging
+import threading
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-from models import DiscoveryRule
+from models import DiscoveryRule, DiscoveryRuleVersion
 from serializer.DiscoveryRuleSerializer import DiscoveryRuleSerializer
 from serializer.DiscoveryRuleSerializer import DiscoveryRuleGetSerializer
 from serializer.DiscoveryRuleSerializer import DiscoveryRuleGetDetailSerializer
@@ -27,123 +30,210 @@ from fabric.fabric_rule import build_fabric_map, build_vpc_detail
 logger = logging.getLogger(__name__)
 
 
-def regex_match(condition,string,value):
-    if(condition=='contain'):
-        if(re.search(string,value)==None):
-            return 0
-        return 1
-    if(condition=='no_contain'):
-        if(re.search(string,value)==None):
-            return 1
-        return 0
-    if(condition=='match'):
-        string='^'+string+'$'
-        if(re.search(string,value)==None):
-            return 0
-        return 1
-    if(condition=='no_match'):
-        string='^'+string+'$'
-        if(re.search(string,value)==None):
-            return 1
-        return 0
-    if(condition=='any'):
-        return 1
-    return 1
+#Compiled discovery rules, see DiscoveryRuleSet. Built on first match and
+#rebuilt when DiscoveryRuleVersion moves
+discovery_rule_set = None
+discovery_rule_lock = threading.Lock()
 
-def match_none(subrule,neighbor_list):
+MATCH_CONDITIONS = ['contain', 'match']
+NO_MATCH_CONDITIONS = ['no_contain', 'no_match']
+ANCHORED_CONDITIONS = ['match', 'no_match']
+NEIGHBOR_KEYS = [('rn', 'remote_node'), ('rp', 'remote_port'), ('lp', 'local_port')]
+
+
+class CompiledSubRule(object):
+    '''
+    One subrule with its three patterns compiled and match/no_match anchored.
+    Conditions without a pattern (any, exact, oneof) accept every value.
+    '''
+    def __init__(self, subrule):
+        self.has_none = False
+        self.conditions = []
+        for prefix, neigh_key in NEIGHBOR_KEYS:
+            condition = subrule[prefix + '_condition']
+            string = subrule[prefix + '_string']
+            if condition == 'none':
+                self.has_none = True
+            if condition in ANCHORED_CONDITIONS:
+                string = '^' + string + '$'
+            if condition in MATCH_CONDITIONS or condition in NO_MATCH_CONDITIONS or condition == 'none':
+                self.conditions.append((neigh_key, condition, re.compile(string)))
+            else:
+                self.conditions.append((neigh_key, condition, None))
+
+    def matches(self, neighbor_list):
+        if self.has_none:
+            # a none condition fails if any neighbor contains its string
+            for neigh_key, condition, pattern in self.conditions:
+                if condition == 'none':
+                    for neigh in neighbor_list:
+                        if pattern.search(neigh[neigh_key]):
+                            return False
+            return True
 
-    if(subrule['rn_condition']=='none'):
-        for neigh in neighbor_list:
-            if (regex_match('contain',subrule['rn_string'],neigh['remote_node'])):
-                return 0
-    if(subrule['rp_condition']=='none'):
-        for neigh in neighbor_list:
-            if (regex_match('contain',subrule['rp_string'],neigh['remote_port'])):
-                return 0
-    if(subrule['lp_condition']=='none'):
         for neigh in neighbor_list:
-            if (regex_match('contain',subrule['lp_string'],neigh['local_port'])):
-                return 0
-    return 1
-    
+            for neigh_key, condition, pattern in self.conditions:
+                if pattern is None:
+                    continue
+                found = pattern.search(neigh[neigh_key]) is not None
+                if found != (condition in MATCH_CONDITIONS):
+                    break
+            else:
+                logger.debug("Matched a neighbor_list "+str(neigh))
+                return True
+        return False
+
+
+class CompiledDiscoveryRule(object):
+
+    def __init__(self, rule_obj):
+        self.id = rule_obj.id
+        self.config_id = rule_obj.config_id
+        self.match = rule_obj.match
+        self.fabric_id = rule_obj.fabric_id
+        self.replica_num = rule_obj.replica_num
+        self.switch_name = rule_obj.switch_name
+        if self.match == 'serial_id':
+            self.serial_ids = rule_obj.subrules
+            self.subrules = []
+        else:
+            self.serial_ids = []
+            self.subrules = [CompiledSubRule(subrule) for subrule in rule_obj.subrules]
+
+    def matches(self, neighbor_list):
+        if self.match == 'all':
+            if not self.subrules:
+                return False
+            for subrule in self.subrules:
+                if not subrule.matches(neighbor_list):
+                    return False
+            return True
+        if self.match == 'any':
+            for subrule in self.subrules:
+                if subrule.matches(neighbor_list):
+                    return True
+        return False
+
+
+class DiscoveryRuleSet(object):
+    '''
+    Neighbor rules as a priority ordered list and serial_id rules as a
+    serial -> rule dict, where the highest priority rule owns a serial.
+    '''
+    def __init__(self, version):
+        self.version = version
+        self.rules = []
+        self.serial_ids = {}
+        for rule_obj in DiscoveryRule.objects.order_by('priority', 'id').iterator():
+            try:
+                rule = CompiledDiscoveryRule(rule_obj)
+            except (ValueError, KeyError, SyntaxError, re.error), e:
+                logger.error("Skipping invalid discoveryrule id: " + str(rule_obj.id) + " error: " + str(e))
+                continue
+            if rule.match == 'serial_id':
+                for serial_id in rule.serial_ids:
+                    self.serial_ids.setdefault(serial_id, rule)
+            else:
+                self.rules.append(rule)
+        logger.debug("Compiled " + str(len(self.rules)) + " discoveryrules and " +\
+                     str(len(self.serial_ids)) + " serial ids")
+
+    def match_neighbors(self, neighbor_list):
+        for rule in self.rules:
+            if rule.matches(neighbor_list):
+                return rule
+        return None
+
+    def match_serial_id(self, serial_id):
+        return self.serial_ids.get(serial_id)
+
+
+def get_discovery_rule_version():
+    version = DiscoveryRuleVersion.objects.filter(id = 1).values_list('version', flat = True).first()
+    if version is None:
+        return 0
+    return version
+
+
+#Runs in the transaction writing the rule (DiscoveryRule.save and deletes
+#are atomic), so the version only moves once the row is committed
+@receiver(post_save, sender=DiscoveryRule)
+@receiver(post_delete, sender=DiscoveryRule)
+def bump_discovery_rule_version(sender, **kwargs):
+    if DiscoveryRuleVersion.objects.filter(id = 1).update(version = F('version') + 1):
+        return
+    #first write, a concurrent one may create the row too
+    try:
+        with transaction.atomic():
+            DiscoveryRuleVersion.objects.create(id = 1, version = 1)
+    except IntegrityError:
+        DiscoveryRuleVersion.objects.filter(id = 1).update(version = F('version') + 1)
 
-def match_discovery_rules(cdp_nei_list):
+
+#The version is read before the rows, a set that already holds newer rows
+#than its version says is only rebuilt once more
+def get_discovery_rule_set():
+    global discovery_rule_set
+    version = get_discovery_rule_version()
+    rule_set = discovery_rule_set
+    if rule_set is None or rule_set.version != version:
+        with discovery_rule_lock:
+            if discovery_rule_set is None or discovery_rule_set.version != version:
+                discovery_rule_set = DiscoveryRuleSet(version)
+            rule_set = discovery_rule_set
+    return rule_set
+
+
+#For rows written without signals, e.g. loaded in bulk
+def invalidate_discovery_rule_set():
+    global discovery_rule_set
+    with discovery_rule_lock:
+        discovery_rule_set = None
+
+
+def match_discovery_rules(match_ctx, cdp_nei_list):
     neighbor_list = cdp_nei_list['neighbor_list']
-    discoveryrule = DiscoveryRule.objects.exclude(match='serial_id').order_by('priority')
     match_response = dict(FABRIC_MATCH_RESPONSE)
     config_id = INVALID
+    dis_obj = None
+    
+    rule_set = match_ctx.discovery_rule_set
+    if rule_set is None:
+        rule_set = get_discovery_rule_set()
     
     if len(neighbor_list) > 0:
-        for single_obj in discoveryrule.iterator():
-            subrules_list = json.loads(single_obj.subrules)
-            all_subrule_match_flag = 0
-            for subrule in subrules_list:
-                subrule_match_flag = 0
-                
-                if(subrule['rn_condition']=='none' or subrule['rp_condition']=='none' or subrule['lp_condition']=='none'):
-                    subrule_match_flag = match_none(subrule,neighbor_list)
-                    logger.debug("Subrule has a none condition. Checked it in all neighbor_list and the result is: "+str(bool(subrule_match_flag)))
-                else:            
-                    for neigh in neighbor_list:
-                        if(regex_match(subrule['rn_condition'],subrule['rn_string'],neigh['remote_node'])):
-                            if(regex_match(subrule['rp_condition'],subrule['rp_string'],neigh['remote_port'])):
-                                if(regex_match(subrule['lp_condition'],subrule['lp_string'],neigh['local_port'])):
-                                    subrule_match_flag = 1
-                                    logger.debug("Matched a neighbor_list "+str(neigh)+" with subrule "+str(subrule))
-                                    break
-                
-                if single_obj.match == 'all':
-                    if subrule_match_flag == 0:
-                        all_subrule_match_flag = 0
-                        break
-                    else:
-                        all_subrule_match_flag = 1
-                elif single_obj.match == 'any':
-                    if subrule_match_flag == 1:
-                        all_subrule_match_flag = 1
-                        break
-
-            if all_subrule_match_flag == 1:
-                config_id = single_obj.config_id
-                match_response["DISCOVERYRULE_ID"] = single_obj.id
-                match_response["MATCH_TYPE"] = MATCH_TYPE_NEIGHBOUR
-                logger.debug("The matching discoveryrule id is: "+str(single_obj.id))
-                break
+        dis_obj = rule_set.match_neighbors(neighbor_list)
+        if dis_obj:
+            config_id = dis_obj.config_id
+            match_response["DISCOVERYRULE_ID"] = dis_obj.id
+            match_response["MATCH_TYPE"] = MATCH_TYPE_NEIGHBOUR
+            logger.debug("The matching discoveryrule id is: "+str(dis_obj.id))
         
     if config_id==INVALID:
-        discoveryrule = DiscoveryRule.objects.filter(match='serial_id').order_by('priority')
-        serial_id = cdp_nei_list['system_id']
-        for single_obj in discoveryrule.iterator():
-            subrules_list = ast.literal_eval(single_obj.subrules)
-            for subrule_serial_id in subrules_list:
-                if serial_id == subrule_serial_id:
-                    config_id=single_obj.config_id
-                    match_response["DISCOVERYRULE_ID"] = single_obj.id
-                    match_response["MATCH_TYPE"] = MATCH_TYPE_SYSTEM_ID
-                    logger.debug("The matching discoveryrule with serial-id is: "+str(single_obj.id))
-                    break
-            if config_id!=INVALID:
-                break
+        dis_obj = rule_set.match_serial_id(cdp_nei_list['system_id'])
+        if dis_obj:
+            config_id = dis_obj.config_id
+            match_response["DISCOVERYRULE_ID"] = dis_obj.id
+            match_response["MATCH_TYPE"] = MATCH_TYPE_SYSTEM_ID
+            logger.debug("The matching discoveryrule with serial-id is: "+str(dis_obj.id))
     logger.debug("The configuration id is: "+str(config_id))
     if config_id != INVALID: 
         match_response["CFG_ID"] = config_id
         match_response["SWITCH_ID"] = cdp_nei_list['system_id']
         # calling build functions from fabric
-        dis_obj = DiscoveryRule.objects.get(id = match_response["DISCOVERYRULE_ID"])
         if dis_obj.fabric_id != INVALID:
             # filling match_response for serialId match
             match_response['FABRIC_ID'] = dis_obj.fabric_id
             match_response['REPLICA_NUM'] = dis_obj.replica_num
             match_response['SWITCH_ID'] = dis_obj.switch_name
             
-            fabric_obj = Fabric.objects.get(id = dis_obj.fabric_id)
+            fabric_obj = Fabric.objects.only('name', 'topology').get(id = dis_obj.fabric_id)
             fabric_name = fabric_obj.name
             fabric_name = fabric_name + "_" + str(dis_obj.replica_num) + "_"
-            topology_obj = fabric_obj.topology
             local_node = dis_obj.switch_name
-            build_fabric_map(fabric_name, topology_obj, local_node)
+            build_fabric_map(match_ctx, fabric_name, fabric_obj.topology_id, local_node)
             try:
-                build_vpc_detail(local_node)
+                build_vpc_detail(match_ctx, local_node)
             except KeyError,e:
                 logger.error("Key:" + str(e) + " not found")
                 return match_response
@@ -1,6 +1,7 @@
 __author__  = "arunrajms"
 
-from django.db import models
+from django.db import models, transaction
+from usermanagement.fields import JSONField
 
 # Create your models here.
 
@@ -13,8 +14,23 @@ class DiscoveryRule(models.Model):
     created_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     last_modified = models.DateTimeField(auto_now=True)
     config_id = models.IntegerField(default=0)
-    subrules = models.TextField()
+    subrules = JSONField()
     match = models.CharField(max_length=10,default="all")
-    fabric_id = models.IntegerField(default= -1)
+    fabric_id = models.IntegerField(default= -1, db_index=True)
     replica_num = models.IntegerField(default= -1)
     switch_name = models.CharField(max_length=100,default=' ')
+
+    class Meta:
+        # rules of one match type in priority order, e.g. serial_id rules
+        index_together = (('match', 'priority'),)
+
+    # post_save bumps DiscoveryRuleVersion in the transaction of the row
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        super(DiscoveryRule, self).save(*args, **kwargs)
+
+
+class DiscoveryRuleVersion(models.Model):
+
+    # single row, bumped in every transaction that writes DiscoveryRule
+    version = models.IntegerField(default=0)
@@ -6,7 +6,6 @@ from rest_framework.views import APIView
 from django.views.generic.base import View
 from rest_framework.response import Response
 from rest_framework import status
-import ast
 import random
 import json
 import logging
@@ -20,7 +19,7 @@ from serializer.DiscoveryRuleSerializer import DiscoveryRuleSerialIDSerializer
 from serializer.DiscoveryRuleSerializer import DiscoveryRulePutSerializer
 from serializer.DiscoveryRuleSerializer import DiscoveryRuleIDPutSerializer
 
-from usermanagement.utils import RequestValidator
+from usermanagement.utils import RequestValidator, get_usernames, ListRequest
 from django.http import JsonResponse
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
@@ -40,22 +39,24 @@ class DiscoveryRuleList(APIView,RequestValidator):
             return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
             
     def get(self, request, format=None):
-        discoveryrule = DiscoveryRule.objects.all()
-        serializer = DiscoveryRuleGetSerializer(discoveryrule, many=True)
-        index = 0
+        # fabric generated rules aren't listed, subrules aren't shown
+        list_request = ListRequest(request)
+        discoveryrule = list_request.page(DiscoveryRule.objects.filter(fabric_id = -1).order_by('id')\
+                        .only('id', 'name', 'priority', 'used_count', 'user_id', 'created_date', 'last_modified',\
+                              'config_id', 'match', 'fabric_id'))
+        serializer = list_request.serializer(DiscoveryRuleGetSerializer(discoveryrule, many=True))
+        user_names = get_usernames([rule.user_id for rule in discoveryrule])
         resp = []
-        for item in serializer.data:
+        for rule, item in zip(discoveryrule, serializer.data):
             try:
-                if item['fabric_id'] == -1:
-                    item['user_name'] = User.objects.get(id=discoveryrule[index].user_id).username
-                    del item['fabric_id']
-                    resp.append(item)
-            except User.DoesNotExist:
+                item['user_name'] = user_names[rule.user_id]
+                item.pop('fabric_id', None)
+                resp.append(item)
+            except KeyError:
                 #TODO : log
                 logger.error("Username does not exist")
                 raise Http404
-            index = index + 1
-        return Response(resp)
+        return list_request.response(resp)
 
     def post(self, request, format=None):
         me = RequestValidator(request.META)
@@ -80,9 +81,7 @@ class DiscoveryRuleList(APIView,RequestValidator):
                 rule_object.priority = serializer.data['priority']
                 rule_object.user_id = me.user_is_exist().user_id
                 rule_object.config_id = serializer.data['config_id']
-                for i in range(len(serializer.data['subrules'])):
-                    serializer.data['subrules'][i]=str(serializer.data['subrules'][i])
-                rule_object.subrules = str(serializer.data['subrules'])
+                rule_object.subrules = [str(subrule) for subrule in serializer.data['subrules']]
                 rule_object.match = serializer.data['match']
                 rule_object.save()
                 serializer = DiscoveryRuleGetSerializer(rule_object)
@@ -113,12 +112,11 @@ class DiscoveryRuleDetailList(APIView,RequestValidator):
         if serializer1.data['match']!='serial_id':
             serializer = DiscoveryRuleGetDetailSerializer(discoveryrule)
             data = dict(serializer.data)
-            data['subrules'] = json.loads(data['subrules'])
             data['user_name'] = User.objects.get(id=discoveryrule.user_id).username
             return Response(data)
         else:
             data = dict(serializer1.data)
-            data['subrules'] = ast.literal_eval(str(discoveryrule.subrules))
+            data['subrules'] = discoveryrule.subrules
             data['user_name'] = User.objects.get(id=discoveryrule.user_id).username
             return Response(data)
         
@@ -142,7 +140,6 @@ class DiscoveryRuleDetailList(APIView,RequestValidator):
                 rule_object.save()
                 serializer = DiscoveryRuleGetDetailSerializer(rule_object)
                 resp = serializer.data
-                resp['subrules'] = json.loads(resp['subrules'])
                 return Response(resp)
         else:
             if request.data['name'] == self.get_object(id).name:
@@ -151,9 +148,7 @@ class DiscoveryRuleDetailList(APIView,RequestValidator):
                 serializer = DiscoveryRuleSerialIDSerializer(data=request.data)
             if serializer.is_valid():
                 rule_object = self.get_object(id)
-                for i in range(len(serializer.data['subrules'])):
-                    serializer.data['subrules'][i]=str(serializer.data['subrules'][i])
-                subrules = str(serializer.data['subrules'])
+                subrules = [str(subrule) for subrule in serializer.data['subrules']]
                 rule_object.name = serializer.data['name']
                 rule_object.subrules = subrules
                 rule_object.priority = serializer.data['priority']
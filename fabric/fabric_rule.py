@@ -6,24 +6,58 @@ from const import *
 from switchdb import *
 import re
 import logging
+import itertools
+import threading
+from collections import namedtuple
 from netaddr import *
-from django.db import transaction
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.conf import settings
 
 #Imports from user defined modules
-from models import Fabric, FabricRuleDB
+from models import Fabric, FabricRuleDB, FabricRuleVersion
+from topology_graph import get_topology_graph
 from pool.pool import generate_pool_value, generate_vpc_peer_dest
 logger = logging.getLogger(__name__)
 
 
 #Globals
-switch_peer_map =   [] 
-switch_type_map = {}
-link_type_map = {}
-vpc_detail_response = {} 
-switch_fabric_if_list = []
-leaf_list = []
-spine_list = []
-core_list = []
+#Neighbour index (FabricRuleIndex) of every FabricRuleDB row
+#Built from FabricRuleDB on first use, rebuilt when FabricRuleVersion moves
+FabricRuleMatch = namedtuple('FabricRuleMatch', ['local_node', 'configuration_id', 'replica_num',\
+                             'fabric_id', 'fabric_name', 'topology_id', 'num_instance'])
+fabric_rule_index = None
+fabric_rule_index_lock = threading.Lock()
+
+#Virtual replica mode: a fabric's rules are written once against base switch
+#names with replica_num 0 and the replica is read from remote_node on match,
+#so rule count no longer grows with the number of replicas
+try:
+    FABRIC_VIRTUAL_REPLICA_RULES = settings.FABRIC_VIRTUAL_REPLICA_RULES
+except AttributeError:
+    FABRIC_VIRTUAL_REPLICA_RULES = False
+
+#Every "_<n>_" in a switch name, overlapping, as fabric names may hold them too
+REPLICA_REGEX = re.compile("(?=_([1-9][0-9]*)_)")
+
+#Rows per bulk INSERT when a fabric's rules are generated
+FABRIC_RULE_BATCH_SIZE = 1000
+
+
+class MatchContext(object):
+    '''
+    Per POAP request state filled in while a switch is matched and read back
+    by generate_instance_value while its config is built. A batch passes the
+    same fabric rule index / discovery rule set to every context so all of
+    its switches match against one snapshot.
+    '''
+    def __init__(self, fabric_rule_index=None, discovery_rule_set=None):
+        self.fabric_rule_index = fabric_rule_index
+        self.discovery_rule_set = discovery_rule_set
+        self.topology = None
+        self.fabric_name = ""
+        self.node = None
+        self.vpc_detail_response = dict(VPC_DETAIL_RESPONSE)
 
 
 def get_instance_number(fabric_name, remote_node):
@@ -62,15 +96,110 @@ def log_match_info(match_response):
     logger.info("Replica Num: " + str(match_response["REPLICA_NUM"]))
 
 
+class FabricRuleIndex(object):
+    '''
+    exact  : (remote_node, remote_port, local_port) -> FabricRuleMatch
+    virtual: (fabric_name, base remote_node, remote_port, local_port) ->
+             FabricRuleMatch with the base local_node, for replica_num 0 rows
+    '''
+    def __init__(self, version):
+        self.version = version
+        self.exact = {}
+        self.virtual = {}
+
+    def __len__(self):
+        return len(self.exact) + len(self.virtual)
+
+    def lookup(self, remote_node, remote_port, local_port):
+        rule = self.exact.get((remote_node, remote_port, local_port))
+        if rule is not None or not self.virtual:
+            return rule
+
+        #try every <fabric>_<n>_<base> split of the neighbour's name
+        for match in REPLICA_REGEX.finditer(remote_node):
+            replica = match.group(1)
+            fabric_name = remote_node[:match.start()]
+            base_node = remote_node[match.start() + len(replica) + 2:]
+            rule = self.virtual.get((fabric_name, base_node, remote_port, local_port))
+            if rule is not None and int(replica) <= rule.num_instance:
+                return rule._replace(local_node = fabric_name + "_" + replica + "_" + rule.local_node,\
+                                     replica_num = int(replica))
+        return None
+
+
+#Load every FabricRuleDB row in one query and key it on the CDP tuple
+#a booting switch reports. First rule (lowest id) wins on duplicates.
+def build_fabric_rule_index(version):
+
+    index = FabricRuleIndex(version)
+    rules = FabricRuleDB.objects.order_by('id').values_list('remote_node', 'remote_port', 'local_port',\
+            'local_node', 'action', 'replica_num', 'fabric_id', 'fabric__name', 'fabric__topology_id',\
+            'fabric__instance')
+    for rule in rules.iterator():
+        if rule[5] == 0:
+            key = (rule[7], rule[0], rule[1], rule[2])
+            table = index.virtual
+        else:
+            key = (rule[0], rule[1], rule[2])
+            table = index.exact
+        if key not in table:
+            table[key] = FabricRuleMatch(*rule[3:])
+    logger.debug("Fabric Rule index built with " + str(len(index)) + " entries")
+    return index
+
+
+def get_fabric_rule_version():
+    version = FabricRuleVersion.objects.filter(id = 1).values_list('version', flat = True).first()
+    if version is None:
+        return 0
+    return version
+
+
+#Must run in the transaction writing the rules: the version only moves once
+#they are committed, so an index built from the old rows while the write is
+#in flight keeps the old version and is rebuilt on the next lookup
+def bump_fabric_rule_version():
+    if FabricRuleVersion.objects.filter(id = 1).update(version = F('version') + 1):
+        return
+    #first write, a concurrent one may create the row too
+    try:
+        with transaction.atomic():
+            FabricRuleVersion.objects.create(id = 1, version = 1)
+    except IntegrityError:
+        FabricRuleVersion.objects.filter(id = 1).update(version = F('version') + 1)
+
+
+#The version is read before the rows, an index that already holds newer rows
+#than its version says is only rebuilt once more
+def get_fabric_rule_index():
+    global fabric_rule_index
+    version = get_fabric_rule_version()
+    index = fabric_rule_index
+    if index is None or index.version != version:
+        with fabric_rule_index_lock:
+            if fabric_rule_index is None or fabric_rule_index.version != version:
+                fabric_rule_index = build_fabric_rule_index(version)
+            index = fabric_rule_index
+    return index
+
+
+#For rows written without bump_fabric_rule_version, e.g. loaded in bulk
+def invalidate_fabric_rule_index():
+    global fabric_rule_index
+    with fabric_rule_index_lock:
+        fabric_rule_index = None
+
+
 #delete all fabric rules with fabric_id == <fabric_id>
 @transaction.atomic
 def delete_fabric_rules(fabric_id):
     FabricRuleDB.objects.filter(fabric_id = fabric_id).delete()
+    bump_fabric_rule_version()
     return True
 
 
-#Write to Fabric DB
-def write_to_FabricRuleDB(local_node, remote_node, local_port, remote_port, action, fabric, replica_num):
+#Unsaved Fabric DB row, written in bulk by write_fabric_rules
+def new_fabric_rule(local_node, remote_node, local_port, remote_port, action, fabric, replica_num):
 
     fabricRuleDB_obj                = FabricRuleDB()
     fabricRuleDB_obj.local_node     = local_node
@@ -80,7 +209,53 @@ def write_to_FabricRuleDB(local_node, remote_node, local_port, remote_port, acti
     fabricRuleDB_obj.action         = action
     fabricRuleDB_obj.fabric         = fabric
     fabricRuleDB_obj.replica_num    = replica_num
-    fabricRuleDB_obj.save()
+    return fabricRuleDB_obj
+
+
+#Write rows from an iterable in chunks of FABRIC_RULE_BATCH_SIZE, so only
+#one chunk is in memory however many replicas the fabric has
+def write_fabric_rules(fabric_rules):
+
+    count = 0
+    while True:
+        chunk = list(itertools.islice(fabric_rules, FABRIC_RULE_BATCH_SIZE))
+        if not chunk:
+            break
+        FabricRuleDB.objects.bulk_create(chunk)
+        count += len(chunk)
+    return count
+
+
+#Rows of every replica in link, replica, port order, local side first.
+#virtual: one set of rows with base names and replica_num 0 (see FabricRuleIndex)
+def iter_fabric_rules(fabric_name, num_instance, fabric, switch_to_configuration_id, core_switch_set, link_list,\
+                      virtual = False):
+
+    if virtual:
+        replicas = [0]
+    else:
+        replicas = range(1, num_instance + 1)
+
+    for link in link_list:
+        action1 = switch_to_configuration_id.get(link[SWITCH_1], INVALID)
+        action2 = switch_to_configuration_id.get(link[SWITCH_2], INVALID)
+        for replica_num in replicas:
+            inst_str = "_" + str(replica_num) + "_"
+            switch1 = fabric_name + inst_str + link[SWITCH_1]
+            switch2 = fabric_name + inst_str + link[SWITCH_2]
+            #core check is on the replica names in both modes, so both write
+            #rules for the same switches
+            write1 = switch1 not in core_switch_set
+            write2 = switch2 not in core_switch_set
+            if virtual:
+                switch1 = link[SWITCH_1]
+                switch2 = link[SWITCH_2]
+
+            for index in range(len(link[PORTLIST_1])):
+                if write1:
+                    yield new_fabric_rule(switch1, switch2, link[PORTLIST_1][index], link[PORTLIST_2][index], action1, fabric, replica_num)
+                if write2:
+                    yield new_fabric_rule(switch2, switch1, link[PORTLIST_2][index], link[PORTLIST_1][index], action2, fabric, replica_num)
 
 
 #To build Fabric specific Rule DB
@@ -98,12 +273,12 @@ def generate_fabric_rules(fabric_name ,num_instance, fabric, switch_config_info,
 
     switch_to_configuration_id = {}
     switch_set = set()
-    core_switch_list = []
+    core_switch_set = set()
     core_switch_info = topology_info[CORE_LIST]
     link_list = topology_info[LINK_LIST]
 
     for switch_info in core_switch_info:
-        core_switch_list.append(switch_info[SWITCH_NAME])
+        core_switch_set.add(switch_info[SWITCH_NAME])
 
     for link in link_list:
        switch_set.add(link[SWITCH_1])
@@ -115,103 +290,45 @@ def generate_fabric_rules(fabric_name ,num_instance, fabric, switch_config_info,
             return False
         switch_to_configuration_id[item[SWITCH_NAME]] = item[CONFIGURATION_ID]
 
-    for link in link_list:
-        for inst in range(num_instance):
-            inst_str = "_" + str(inst + 1) + "_"
-            switch1 = fabric_name + inst_str + link[SWITCH_1]
-            switch2 = fabric_name + inst_str + link[SWITCH_2]
+    for switch in switch_set:
+        if switch not in switch_to_configuration_id:
+            logger.error("No Configuration provided for switch: " + switch + " Adding Configuraion ID: INVALID")
 
-            for index in range(len(link[PORTLIST_1])):
-                try:
-                    action = switch_to_configuration_id[link[SWITCH_1]]
-                except KeyError:
-                    action = INVALID
-                    logger.error("No Configuration provided for switch: " + switch1 + " Adding Configuraion ID: INVALID")
-                if switch1 not in core_switch_list:
-                    write_to_FabricRuleDB(switch1, switch2, link[PORTLIST_1][index], link[PORTLIST_2][index], action, fabric, inst+1)
-
-                try:
-                    action = switch_to_configuration_id[link[SWITCH_2]]
-                except KeyError:
-                    action = INVALID
-                    logger.error("No Configuration provided for switch: " + switch2 + " Adding Configuraion ID: INVALID")
-                if switch2 not in core_switch_list:
-                    write_to_FabricRuleDB(switch2, switch1, link[PORTLIST_2][index], link[PORTLIST_1][index], action, fabric, inst+1)
-
-    logger.info("Write To Fabric Rule DB successfull")
+    count = write_fabric_rules(iter_fabric_rules(fabric_name, num_instance, fabric, switch_to_configuration_id,\
+                                                 core_switch_set, link_list, FABRIC_VIRTUAL_REPLICA_RULES))
+    bump_fabric_rule_version()
+
+    logger.info("Write To Fabric Rule DB successfull, rules: " + str(count))
     return True
 
 
 
-#Function to parse topology JSON and buid following maps
-#switch_tier_map : switch_name -> Tier
-#switch_peer_map : switch_name - > [{peer_name:[[source port list][destination port list]]}, {peer_name:[[source port list][destination port list]]}]
-def add_to_peer_map(peer_switch_name, localport_list, remoteport_list):
-
-    peer_info = dict()
-    peer_info[peer_switch_name] = [localport_list, remoteport_list]
-    switch_peer_map.append(peer_info)
-
-
-def build_fabric_map(fabric_name, topology_obj, local_node):
-
-    have_fabric_ports = False
-    topology_info = json.loads(topology_obj.topology_json)
-
-    for switch in topology_info[CORE_LIST]:
-        key = fabric_name + switch[SWITCH_NAME]
-        core_list.append(key)
-        switch_type_map[key] = switch[SWITCH_TYPE]
-    for switch in topology_info[SPINE_LIST]:
-        key = fabric_name + switch[SWITCH_NAME]
-        spine_list.append(key)
-        switch_type_map[key] = switch[SWITCH_TYPE]
-    for switch in topology_info[LEAF_LIST]:
-        key = fabric_name + switch[SWITCH_NAME]
-        leaf_list.append(key)
-        switch_type_map[key] = switch[SWITCH_TYPE]
-
-    for link in topology_info[LINK_LIST]:
-        have_fabric_ports = False
-        switch1 = fabric_name + link[SWITCH_1]
-        switch2 = fabric_name + link[SWITCH_2]
-        if ((switch1 == local_node) or (switch2 == local_node)):
-            if (((switch1 in leaf_list) and (switch2 in spine_list)) or\
-                ((switch2 in leaf_list) and (switch1 in spine_list))):
-                    have_fabric_ports = True 
-
-            if switch1 == local_node:
-                add_to_peer_map(switch2, link[PORTLIST_1],link[PORTLIST_2])
-                link_type_map.update({switch2:link[LINK_TYPE]})
-                if have_fabric_ports:
-                    for port in link[PORTLIST_1]:
-                        switch_fabric_if_list.append(port)
-            else:
-                add_to_peer_map(switch1, link[PORTLIST_2], link[PORTLIST_1])
-                link_type_map.update({switch1:link[LINK_TYPE]})
-                if have_fabric_ports:
-                    for port in link[PORTLIST_2]:
-                        switch_fabric_if_list.append(port)
-                        
+#Look the switch up in the compiled base topology (see topology_graph.py)
+#Input
+#1.fabric_name : "<fabric>_<replica>_" prefix of the switch names in this replica
+#2.topology_id : base topology of the fabric
+#3.local_node  : switch being booted, with the prefix
+def build_fabric_map(match_ctx, fabric_name, topology_id, local_node):
+
+    match_ctx.topology = get_topology_graph(topology_id)
+    match_ctx.fabric_name = fabric_name
+    if local_node.startswith(fabric_name):
+        match_ctx.node = match_ctx.topology.nodes.get(local_node[len(fabric_name):])
+    if match_ctx.node is None:
+        logger.error("Switch: " + local_node + " not found in topology id: " + str(topology_id))
+
 
 #To find the VPC peers of a leaf switch
 #Input:
 #1. leaf switch name
-#2. cdp info.
 #output: VPC_DETAIL_RESPONSE = {VPC_PEER_SWITCH:"",VPC_SWITCH_LOCALPORT:[]}
-def build_vpc_detail(switch):
-
-    vpc_peer_switches = []
-    vpc_switch_localport = []
-    peer_cdp_status = []
-    peer_detail_list = switch_peer_map
-    for peer_detail in  peer_detail_list:
-        for peer,port_list in peer_detail.items():
-            if  re.match(TOPOLOGY_LINK_TYPES[1], link_type_map[peer]):
-                localport_list = port_list[0]
-                vpc_detail_response[VPC_PEER_SWITCH] = peer
-                vpc_detail_response[VPC_SWITCH_LOCALPORT] = localport_list
-                break
+def build_vpc_detail(match_ctx, switch):
+
+    node = match_ctx.node
+    vpc_detail_response = match_ctx.vpc_detail_response
+    if node is not None and node.vpc_peer:
+        vpc_detail_response[VPC_PEER_SWITCH] = match_ctx.fabric_name + node.vpc_peer
+        vpc_detail_response[VPC_SWITCH_LOCALPORT] = node.vpc_localports
 
     logger.debug("VPC Details- Local_Node "+ switch + " Peer_Switch: " + vpc_detail_response[VPC_PEER_SWITCH])
 
@@ -221,62 +338,36 @@ def build_vpc_detail(switch):
 #output :
 #match_response = \
 #{"CFG_ID":INVALID,"FABRIC_ID":INVALID,"SWITCH_ID":"switch name"}
-def match_fabric_rules(poap_info):
-
-    #clean up the global DS on receive on new CDP info.
-    global switch_peer_map
-    switch_peer_map = []
-    global switch_fabric_if_list
-    switch_fabric_if_list = [] 
-    global switch_type_map
-    switch_type_map = {}
-    global vpc_detail_response
-    vpc_detail_response = dict(VPC_DETAIL_RESPONSE) 
-    global leaf_list
-    leaf_list = []
-    global spine_list
-    spine_list = []
-    global core_list
-    core_list = []
-    global link_type_map
-    link_type_map = {}
+def match_fabric_rules(match_ctx, poap_info):
 
     cdp_neighbors = poap_info[NEIGHBOR_LIST]
     configuration_id = INVALID
-    fabricRuleDB_obj= FabricRuleDB
-    remote_node  = ""
-    local_node = ""
-    replica_num = INVALID
-    fabric_id = INVALID
+    fabric_rule = None
     match_response = dict(FABRIC_MATCH_RESPONSE)
 
     if not is_empty(cdp_neighbors):
+        rule_index = match_ctx.fabric_rule_index
+        if rule_index is None:
+            rule_index = get_fabric_rule_index()
         for link in cdp_neighbors:
-            remote_node = link[REMOTE_NODE]
-            remote_port = link[REMOTE_PORT]
-            local_port = link[LOCAL_PORT]
             logger.debug("Neighbour" + str(link))
-            try:
-                fabricRuleDB_obj = FabricRuleDB.objects.get(remote_node = remote_node, remote_port = remote_port, local_port = local_port)
-                configuration_id = fabricRuleDB_obj.action
-                fabric_id = fabricRuleDB_obj.fabric.id
-                fabric_name = fabricRuleDB_obj.fabric.name
-                local_node = fabricRuleDB_obj.local_node
-                replica_num = fabricRuleDB_obj.replica_num
+            fabric_rule = rule_index.lookup(link[REMOTE_NODE], link[REMOTE_PORT], link[LOCAL_PORT])
+            if fabric_rule:
+                configuration_id = fabric_rule.configuration_id
                 logger.debug("FabricRuleDB DB Match Success")
                 break
-            except FabricRuleDB.DoesNotExist:
-                logger.error("FabricRuleDB DB Match Failed")
+            logger.error("FabricRuleDB DB Match Failed")
 
         if configuration_id != INVALID:
-            topology_obj = fabricRuleDB_obj.fabric.topology
-            instance_num = get_instance_number(fabric_name, local_node)
-            fabric_name = fabric_name + "_" + instance_num + "_"
-            build_fabric_map(fabric_name, topology_obj, local_node)
-            build_match_response(local_node, fabric_id, configuration_id, replica_num, MATCH_TYPE_NEIGHBOUR, match_response)
+            local_node = fabric_rule.local_node
+            instance_num = get_instance_number(fabric_rule.fabric_name, local_node)
+            fabric_name = fabric_rule.fabric_name + "_" + instance_num + "_"
+            build_fabric_map(match_ctx, fabric_name, fabric_rule.topology_id, local_node)
+            build_match_response(local_node, fabric_rule.fabric_id, configuration_id, fabric_rule.replica_num,\
+                                 MATCH_TYPE_NEIGHBOUR, match_response)
             log_match_info(match_response)
             try:
-                build_vpc_detail(local_node)
+                build_vpc_detail(match_ctx, local_node)
             except KeyError,e:
                 logger.error("Key:" + str(e) + " not found")
                 return match_response
@@ -285,14 +376,14 @@ def match_fabric_rules(poap_info):
     return match_response
 
 
-def generate_instance_value(param_name, fabric_id, switch_name):
+def generate_instance_value(match_ctx, param_name, fabric_id, switch_name):
 
     if  param_name == 'SWITCH_NAME':
         logger.debug("Parameter SWITCH_NAME: " + switch_name)
         return switch_name
 
     if  param_name == 'VPC_PEER_LINK_IF_NAMES':
-        port_list = vpc_detail_response[VPC_SWITCH_LOCALPORT]
+        port_list = match_ctx.vpc_detail_response[VPC_SWITCH_LOCALPORT]
         if is_empty(port_list):
             logger.error("Parameter VPC_PEER_LINK_IF_NAMES is NOT Valid for switch: " + switch_name)
             return "[]"
@@ -304,7 +395,7 @@ def generate_instance_value(param_name, fabric_id, switch_name):
     if  (param_name == 'VPC_PEER_DST' or param_name == 'VPC_PEER_SRC'):
         peer_switch = ""
         ip_str = "0.0.0.0" #Default Value
-        peer_switch = vpc_detail_response[VPC_PEER_SWITCH]
+        peer_switch = match_ctx.vpc_detail_response[VPC_PEER_SWITCH]
         if peer_switch:
             logger.debug("Peer Switch = " + peer_switch)
             if param_name == 'VPC_PEER_DST':
@@ -320,10 +411,10 @@ def generate_instance_value(param_name, fabric_id, switch_name):
 
     if  param_name == 'HOST_PORTS':
         try:
-            port_list = SWITCH_HOST_IF_MAP[switch_type_map[switch_name]]
+            port_list = SWITCH_HOST_IF_MAP[match_ctx.node.switch_type]
             if is_empty(port_list):
                 return "[]"
-        except KeyError:
+        except (KeyError, AttributeError):
             logger.debug("Host Interfaces: No Host ports for Spine switch")
             return "[]"
         port_str = "[ \'" + '\',\''.join(port_list) + "\' ]"
@@ -332,7 +423,9 @@ def generate_instance_value(param_name, fabric_id, switch_name):
             
              
     if  param_name == 'TRUNK_PORTS':
-        port_list  = switch_fabric_if_list
+        port_list = []
+        if match_ctx.node is not None:
+            port_list = match_ctx.node.fabric_ports
         if port_list:
             port_str = "[ \'" + '\',\''.join(port_list) + "\' ]"
             logger.debug("Fabric Interface: " + port_str )
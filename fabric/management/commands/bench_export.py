@@ -0,0 +1,74 @@
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, reset_queries
+
+from fabric.models import Topology, Fabric, FabricRuleDB
+from fabric.fabric_rule import write_fabric_rules
+from usermanagement.utils import export_rows, iter_batches
+
+EXPORT_FIELDS = ('id', 'fabric_id', 'replica_num', 'local_node', 'remote_node', 'remote_port',
+                 'local_port', 'action')
+
+
+class Rollback(Exception):
+    pass
+
+
+def current_rss():
+    with open('/proc/self/statm') as fh:
+        return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class Command(BaseCommand):
+    help = "Export generated fabric rules as the fabric rule export does and report the process RSS. " \
+           "The rules are written in a transaction that is rolled back"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', default='1000,100000,1000000',
+                    help='Comma separated rule counts, one run each'),
+        make_option('--output', default='ndjson', choices=['ndjson', 'csv']),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(count) for count in options['rows'].split(',')]
+        except ValueError:
+            raise CommandError("--rows takes comma separated numbers")
+        for count in counts:
+            self.run(count, options['output'])
+
+    def run(self, count, output):
+        try:
+            with transaction.atomic():
+                topology = Topology.objects.create(name='bench_export_' + str(os.getpid()), topology_json='{}',
+                                                   config_json='[]', defaults='{}')
+                fabric = Fabric.objects.create(name=topology.name, config_json='[]', system_id='[]',
+                                               topology=topology)
+                write_fabric_rules(FabricRuleDB(local_node='bench_' + str(i % 1000) + '_leaf',
+                                                remote_node='bench_' + str(i % 1000) + '_spine',
+                                                remote_port='Ethernet1/' + str(i % 48 + 1),
+                                                local_port='Ethernet2/' + str(i % 48 + 1),
+                                                fabric=fabric, action=1, replica_num=i % 1000)
+                                   for i in xrange(count))
+
+                # DEBUG keeps every query, not part of the export
+                reset_queries()
+                rss_start = current_rss()
+                rss_max = rss_start
+                size = 0
+                start = time.time()
+                batches = iter_batches(FabricRuleDB.objects.filter(fabric=fabric), EXPORT_FIELDS)
+                for chunk in export_rows(EXPORT_FIELDS, batches, output):
+                    size += len(chunk)
+                    rss_max = max(rss_max, current_rss())
+                seconds = time.time() - start
+
+                self.stdout.write("%d rules: %d bytes of %s in %.2fs, RSS %.1f MB at start, %.1f MB max (+%.1f MB)" %
+                                  (count, size, output, seconds, rss_start / 1048576.0, rss_max / 1048576.0,
+                                   (rss_max - rss_start) / 1048576.0))
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,89 @@
+import shutil
+import socket
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fabric.syslog_receiver import SyslogReceiver
+from fabric.syslog_store import SwitchLogStore
+
+
+class Command(BaseCommand):
+    help = "Receive switch syslog into per switch log files, or --bench the receiver with a local sender"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--bind', default='0.0.0.0', help='Address to listen on'),
+        make_option('--udp-port', type='int', default=514, help='UDP port, 0 to not listen on UDP'),
+        make_option('--tcp-port', type='int', default=0, help='TCP port, 0 to not listen on TCP'),
+        make_option('--bench', type='int', default=0, metavar='MESSAGES',
+                    help='Send MESSAGES over UDP and over TCP to a receiver on localhost and report the rates'),
+        make_option('--bench-hosts', type='int', default=100, help='Switches the benchmark messages come from'),
+    )
+
+    def handle(self, *args, **options):
+        if options['bench']:
+            return self.bench(options['bench'], options['bench_hosts'])
+
+        receiver = SyslogReceiver(SwitchLogStore(), options['bind'],
+                                  options['udp_port'] or None, options['tcp_port'] or None)
+        if receiver.udp_port is None and receiver.tcp_port is None:
+            raise CommandError("Nothing to listen on")
+        try:
+            receiver.start()
+        except socket.error, e:
+            raise CommandError("Unable to listen: " + str(e))
+        self.stdout.write("Receiving syslog on " + options['bind'] + ", udp " + str(receiver.udp_port) +
+                          ", tcp " + str(receiver.tcp_port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            receiver.stop()
+
+    def bench(self, count, hosts):
+        store_dir = tempfile.mkdtemp(prefix='syslog_bench')
+        store = SwitchLogStore(store_dir)
+        receiver = SyslogReceiver(store, '127.0.0.1', 0, 0)
+        receiver.start()
+        try:
+            messages = ["<189>Oct  8 10:00:%02d SSI%07d %%ETHPORT-5-IF_UP: Interface Ethernet1/%d is up"
+                        % (i % 60, i % hosts, i % 48) for i in xrange(count)]
+
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            start = time.time()
+            for message in messages:
+                sock.sendto(message, ('127.0.0.1', receiver.udp_port))
+            stored, end = self.wait(receiver, count)
+            self.report("udp", count, stored, end - start)
+            sock.close()
+
+            sock = socket.create_connection(('127.0.0.1', receiver.tcp_port))
+            start = time.time()
+            sock.sendall("".join([message + "\n" for message in messages]))
+            written, end = self.wait(receiver, stored + count)
+            self.report("tcp", count, written - stored, end - start)
+            sock.close()
+        finally:
+            receiver.stop()
+            shutil.rmtree(store_dir, True)
+
+    # lines written and when the last of them was, once all are in or the
+    # store stops growing (lost datagrams)
+    def wait(self, receiver, expected):
+        store = receiver.store
+        written = store.written
+        written_at = time.time()
+        while written < expected and time.time() - written_at < 3 * receiver.flush_interval:
+            time.sleep(0.01)
+            if store.written != written:
+                written = store.written
+                written_at = time.time()
+        return written, written_at
+
+    def report(self, protocol, sent, stored, seconds):
+        self.stdout.write("%s: sent %d, stored %d (%.1f%%) in %.2fs, %d messages/s" %
+                          (protocol, sent, stored, 100.0 * stored / sent, seconds, stored / seconds))
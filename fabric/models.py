@@ -1,12 +1,13 @@
 from django.db import models
+from usermanagement.fields import JSONField
 # Create your models here.
 
 class Topology(models.Model):
 
     name = models.CharField(max_length=100, unique=True)
-    topology_json = models.TextField()
-    config_json = models.TextField()
-    defaults = models.TextField()
+    topology_json = JSONField()
+    config_json = JSONField()
+    defaults = JSONField()
     used = models.IntegerField(default=0)
     user_id = models.IntegerField(default=0)
     status = models.BooleanField(default=True)
@@ -17,8 +18,8 @@ class Topology(models.Model):
 class Fabric(models.Model):
 
     name = models.CharField(max_length=100, unique=True)
-    config_json = models.TextField()
-    system_id = models.TextField()
+    config_json = JSONField()
+    system_id = JSONField()
     locked = models.BooleanField(default=True)
     validate = models.BooleanField(default=True)
     instance = models.IntegerField(default = 1)
@@ -42,6 +43,16 @@ class FabricRuleDB(models.Model):
     status = models.BooleanField(default=True)
     replica_num = models.IntegerField(default=0)
 
+    class Meta:
+        # CDP neighbour a booting switch reports
+        index_together = (('remote_node', 'remote_port', 'local_port'),)
+
+
+class FabricRuleVersion(models.Model):
+
+    # single row, bumped in every transaction that writes FabricRuleDB
+    version = models.IntegerField(default=0)
+
 
 class DeployedFabricStats(models.Model):
     
@@ -53,7 +64,10 @@ class DeployedFabricStats(models.Model):
     boot_time = models.DateTimeField(auto_now=True)
     config_name = models.CharField(max_length=100)
     discoveryrule_id = models.IntegerField(default=-1)
-    system_id = models.CharField(max_length=100)
+    system_id = models.CharField(max_length=100, db_index=True)
     match_type = models.CharField(max_length=100)
     configuration_generated = models.CharField(max_length=100)
     logs = models.CharField(max_length=100, default = 'logs')
+
+    class Meta:
+        index_together = (('fabric_id', 'replica_num'),)
@@ -14,6 +14,7 @@ class DeployedFabricGetSerializer(serializers.Serializer):
     fabric_id = serializers.IntegerField()
     fabric_name = serializers.CharField(required = False)
     total_replicas = serializers.ListField(child = serializers.IntegerField())
+    boot_count = serializers.IntegerField(required = False)
     
 class DeployedFabricDetailGetSerializer(serializers.Serializer):
     id = serializers.IntegerField(read_only = True)
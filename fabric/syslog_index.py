@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+
+'''
+Per host offset index of the syslog, for DeployedLogs.
+
+A background thread tails the syslog and its rotations (syslog.1,
+syslog.2.gz, ...) and appends one fixed size record per line to the index
+file of the line's host, words[LOG_SEARCH_COL]:
+
+    inode, member, offset of the line in the member, unix time
+
+member is where the line's gzip member starts in a .gz file and 0 in a
+plain one, so reading a line back only decompresses from the start of its
+member instead of the start of the file.
+
+files.json keeps how far every log file has been read, keyed by inode so a
+rename by logrotate doesn't get the file indexed again. Records of files
+that went away are dropped from the host files on the next pass.
+
+A log request doesn't index. It reads the host's records, filters them by
+time, adds the lines of the live file the background pass hasn't got to
+yet (at most SYSLOG_TAIL_SCAN bytes of them) and seeks straight to the
+lines of the requested page.
+'''
+
+import binascii
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+from const import LOG_SEARCH_COL
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    SYSLOG_FILE = settings.SYSLOG_FILE
+except AttributeError:
+    SYSLOG_FILE = "/var/log/syslog"
+
+try:
+    SYSLOG_INDEX_DIR = settings.SYSLOG_INDEX_DIR
+except AttributeError:
+    SYSLOG_INDEX_DIR = os.getcwd() + "/syslog_index/"
+
+#Seconds between two passes of the background indexer
+SYSLOG_INDEX_INTERVAL = 5
+
+#Lines held in memory before the host files are appended to
+SYSLOG_INDEX_BATCH = 100000
+
+#Bytes at the end of the live file a log request reads itself
+SYSLOG_TAIL_SCAN = 4 * 1024 * 1024
+
+GZIP_CHUNK = 65536
+
+RECORD = struct.Struct('<QQQI')
+STATE_FILE = "files.json"
+LOCK_FILE = ".lock"
+INDEX_SUFFIX = ".idx"
+
+#"Oct 18 19:10:13" at the start of a traditional syslog line
+SYSLOG_TIME_REGEX = re.compile("^([A-Z][a-z]{2} +[0-9]{1,2} [0-9]{2}:[0-9]{2}:[0-9]{2})")
+
+syslog_indexer = None
+syslog_indexer_lock = threading.Lock()
+
+
+#Log files oldest first as [(path, inode, gz)]: syslog.<n>[.gz] with the
+#highest n first, then the live file
+def log_files():
+    log_dir, log_name = os.path.split(SYSLOG_FILE)
+    rotated = re.compile("^" + re.escape(log_name) + "\.([0-9]+)(\.gz)?$")
+    found = []
+    try:
+        names = os.listdir(log_dir)
+    except OSError:
+        logger.error("Unable to list syslog directory: " + log_dir)
+        return []
+    for name in names:
+        if name == log_name:
+            rank = 0
+        else:
+            match = rotated.match(name)
+            if match is None:
+                continue
+            rank = int(match.group(1))
+        path = os.path.join(log_dir, name)
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            continue
+        found.append((rank, path, inode, name.endswith(".gz")))
+    found.sort(reverse=True)
+    return [(path, inode, gz) for rank, path, inode, gz in found]
+
+
+# (member, offset in the member, line) of every complete line of a gzip
+# file. Raises EOFError when the last member is not complete yet
+def gzip_lines(fh):
+    member = 0
+    while True:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        buf = ""
+        offset = 0
+        read = 0
+        while not decompressor.unused_data:
+            chunk = fh.read(GZIP_CHUNK)
+            if not chunk:
+                break
+            read += len(chunk)
+            buf += decompressor.decompress(chunk)
+            start = 0
+            end = buf.find("\n")
+            while end >= 0:
+                yield member, offset + start, buf[start:end + 1]
+                start = end + 1
+                end = buf.find("\n", start)
+            offset += start
+            buf = buf[start:]
+        if not decompressor.unused_data:
+            if read == 0:
+                return
+            # a finished member leaves what follows it unused
+            decompressor.decompress("\0")
+            if not decompressor.unused_data:
+                raise EOFError("gzip member not complete")
+            return
+        member += read - len(decompressor.unused_data)
+        fh.seek(member)
+
+
+class LogReader(object):
+    '''
+    Lines of one log file by (member, offset). In a gzip file decompression
+    goes on from the previous line when the next one is further on in the
+    same member, and starts over at the member otherwise.
+    '''
+    def __init__(self, path, gz):
+        self.fh = open(path, "rb")
+        self.gz = gz
+        self.member = None
+
+    def close(self):
+        self.fh.close()
+
+    def line_at(self, member, offset):
+        if not self.gz:
+            self.fh.seek(offset)
+            return self.fh.readline()
+        if member != self.member or offset < self.offset:
+            self.fh.seek(member)
+            self.member = member
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            # buf holds the member's data from offset on
+            self.buf = ""
+            self.offset = 0
+        while True:
+            if offset - self.offset <= len(self.buf):
+                self.buf = self.buf[offset - self.offset:]
+                self.offset = offset
+                end = self.buf.find("\n")
+                if end >= 0:
+                    return self.buf[:end + 1]
+            else:
+                self.offset += len(self.buf)
+                self.buf = ""
+            if self.decompressor.unused_data:
+                return self.buf
+            chunk = self.fh.read(GZIP_CHUNK)
+            if not chunk:
+                return self.buf
+            self.buf += self.decompressor.decompress(chunk)
+
+
+def host_index_path(host):
+    if isinstance(host, unicode):
+        host = host.encode('utf-8')
+    return os.path.join(SYSLOG_INDEX_DIR, binascii.hexlify(host) + INDEX_SUFFIX)
+
+
+def read_state():
+    try:
+        with open(os.path.join(SYSLOG_INDEX_DIR, STATE_FILE), "r") as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_state(state):
+    path = os.path.join(SYSLOG_INDEX_DIR, STATE_FILE)
+    with open(path + ".tmp", "w") as fh:
+        json.dump(state, fh)
+    os.rename(path + ".tmp", path)
+
+
+def read_records(path):
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except IOError:
+        return []
+    # a record being appended right now is left out
+    end = len(data) - len(data) % RECORD.size
+    return [RECORD.unpack_from(data, pos) for pos in xrange(0, end, RECORD.size)]
+
+
+class LineClock(object):
+    '''
+    Unix time of syslog lines. The stamp has no year, the current one is
+    used unless that puts the line in the future. Lines without a stamp
+    take the time of the line before them.
+    '''
+    def __init__(self):
+        self.stamp = None
+        self.ts = 0
+
+    def line_time(self, line):
+        match = SYSLOG_TIME_REGEX.match(line)
+        if match is None or match.group(1) == self.stamp:
+            return self.ts
+        now = time.time()
+        year = time.localtime(now).tm_year
+        try:
+            ts = time.mktime(time.strptime(str(year) + " " + match.group(1), "%Y %b %d %H:%M:%S"))
+            if ts > now + 86400:
+                ts = time.mktime(time.strptime(str(year - 1) + " " + match.group(1), "%Y %b %d %H:%M:%S"))
+        except ValueError:
+            return self.ts
+        self.stamp = match.group(1)
+        self.ts = int(ts)
+        return self.ts
+
+
+class SyslogIndexer(object):
+    '''
+    One indexing pass over the log files. Passes of all server processes are
+    serialized by a flock on the index directory.
+    '''
+    def __init__(self):
+        self.pending = {}
+        self.pending_count = 0
+
+    def run(self):
+        if not os.path.isdir(SYSLOG_INDEX_DIR):
+            try:
+                os.makedirs(SYSLOG_INDEX_DIR)
+            except OSError:
+                if not os.path.isdir(SYSLOG_INDEX_DIR):
+                    raise
+        with open(os.path.join(SYSLOG_INDEX_DIR, LOCK_FILE), "a") as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            try:
+                self.index(read_state())
+            finally:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+    def index(self, state):
+        files = log_files()
+        present = set()
+        for path, inode, gz in files:
+            key = str(inode)
+            entry = state.get(key)
+            if entry is not None and entry["gz"] == gz:
+                present.add(key)
+        # files that were deleted, truncated or replaced under a reused inode
+        stale = set(state.keys()) - present
+        for path, inode, gz in files:
+            key = str(inode)
+            entry = state.get(key)
+            if entry is None or key in stale or entry["gz"] != gz:
+                continue
+            if gz:
+                continue
+            try:
+                if os.path.getsize(path) < entry["offset"]:
+                    logger.info("Syslog file truncated, indexing it again: " + path)
+                    stale.add(key)
+            except OSError:
+                pass
+        if stale:
+            self.drop(stale)
+            for key in stale:
+                del state[key]
+            write_state(state)
+
+        for path, inode, gz in files:
+            key = str(inode)
+            if key in state and (gz or state[key]["gz"]):
+                # a compressed file is complete once it has been read
+                continue
+            offset = state[key]["offset"] if key in state else 0
+            try:
+                if gz:
+                    offset = self.index_gzip(path, inode)
+                else:
+                    offset = self.index_file(path, inode, offset, state)
+            except (IOError, EOFError, OSError, zlib.error), e:
+                # logrotate may still be writing a .gz, it is read next time
+                logger.debug("Unable to index syslog file " + path + ": " + str(e))
+                continue
+            state[key] = {"gz": gz, "offset": offset}
+            self.flush(state)
+
+    def index_file(self, path, inode, offset, state):
+        key = str(inode)
+        clock = LineClock()
+        with open(path, "rb") as fh:
+            if offset:
+                fh.seek(offset)
+            while True:
+                line = fh.readline()
+                if not line or not line.endswith("\n"):
+                    # the rest of the line is picked up by the next pass
+                    break
+                self.add(inode, 0, offset, clock.line_time(line), line)
+                offset += len(line)
+                if self.pending_count >= SYSLOG_INDEX_BATCH:
+                    state[key] = {"gz": False, "offset": offset}
+                    self.flush(state)
+        return offset
+
+    # a compressed file is indexed in one go, its records are only kept
+    # once it has been read to the end
+    def index_gzip(self, path, inode):
+        clock = LineClock()
+        pending, pending_count = self.pending, self.pending_count
+        self.pending, self.pending_count = {}, 0
+        try:
+            with open(path, "rb") as fh:
+                for member, offset, line in gzip_lines(fh):
+                    self.add(inode, member, offset, clock.line_time(line), line)
+                for host, records in self.pending.iteritems():
+                    pending.setdefault(host, []).extend(records)
+                pending_count += self.pending_count
+                return fh.tell()
+        finally:
+            self.pending, self.pending_count = pending, pending_count
+
+    def add(self, inode, member, offset, ts, line):
+        words = line.split()
+        if len(words) > LOG_SEARCH_COL and len(words[LOG_SEARCH_COL]) <= 100:
+            self.pending.setdefault(words[LOG_SEARCH_COL], []).append(RECORD.pack(inode, member, offset, ts))
+            self.pending_count += 1
+
+    # host files are appended to before the offsets are saved, a pass that
+    # dies in between leaves duplicate records which readers skip
+    def flush(self, state):
+        for host, records in self.pending.iteritems():
+            with open(host_index_path(host), "ab") as fh:
+                fh.write("".join(records))
+        write_state(state)
+        self.pending = {}
+        self.pending_count = 0
+
+    def drop(self, stale):
+        stale = set([int(key) for key in stale])
+        for name in os.listdir(SYSLOG_INDEX_DIR):
+            if not name.endswith(INDEX_SUFFIX):
+                continue
+            path = os.path.join(SYSLOG_INDEX_DIR, name)
+            records = read_records(path)
+            kept = [record for record in records if record[0] not in stale]
+            if len(kept) == len(records):
+                continue
+            if not kept:
+                os.unlink(path)
+                continue
+            with open(path + ".tmp", "wb") as fh:
+                fh.write("".join([RECORD.pack(*record) for record in kept]))
+            os.rename(path + ".tmp", path)
+
+
+def index_syslog():
+    SyslogIndexer().run()
+
+
+def syslog_indexer_loop():
+    while True:
+        try:
+            index_syslog()
+        except Exception:
+            logger.exception("Syslog indexing failed")
+        time.sleep(SYSLOG_INDEX_INTERVAL)
+
+
+#Start the background indexer of this process, once
+def start_syslog_indexer():
+    global syslog_indexer
+    if syslog_indexer is None:
+        with syslog_indexer_lock:
+            if syslog_indexer is None:
+                syslog_indexer = threading.Thread(target=syslog_indexer_loop, name="syslog-indexer")
+                syslog_indexer.daemon = True
+                syslog_indexer.start()
+
+
+# Records of the lines of hosts in the live file past what the index holds,
+# from at most its last SYSLOG_TAIL_SCAN bytes
+def tail_records(path, inode, pos, indexed, hosts, since, until):
+    records = []
+    try:
+        fh = open(path, "rb")
+    except IOError:
+        return records
+    with fh:
+        size = os.fstat(fh.fileno()).st_size
+        offset = max(indexed, size - SYSLOG_TAIL_SCAN)
+        fh.seek(offset)
+        if offset > indexed:
+            logger.debug("Syslog index is behind, lines before offset " + str(offset) + " left out")
+            # started in the middle of a line
+            offset += len(fh.readline())
+        clock = LineClock()
+        while offset < size:
+            line = fh.readline()
+            if not line.endswith("\n"):
+                break
+            ts = clock.line_time(line)
+            words = line.split()
+            if len(words) > LOG_SEARCH_COL and words[LOG_SEARCH_COL] in hosts and \
+               (since is None or ts >= since) and (until is None or ts < until):
+                records.append((pos, 0, offset, inode))
+            offset += len(line)
+    return records
+
+
+def read_host_logs(hosts, since=None, until=None, offset=0, limit=None):
+    '''
+    Lines logged by any of hosts in log order, optionally only those with
+    since <= time < until, paged by offset and limit.
+    '''
+    start_syslog_indexer()
+
+    hosts = set([host for host in hosts if host])
+    files = log_files()
+    rank = dict([(inode, (pos, path, gz)) for pos, (path, inode, gz) in enumerate(files)])
+    # read before the records: those appended after it was written are
+    # found again by the tail scan and skipped as duplicates below
+    state = read_state()
+
+    records = []
+    for host in hosts:
+        for inode, member, line_offset, ts in read_records(host_index_path(host)):
+            if inode not in rank:
+                continue
+            if since is not None and ts < since:
+                continue
+            if until is not None and ts >= until:
+                continue
+            records.append((rank[inode][0], member, line_offset, inode))
+
+    if files and files[-1][0] == SYSLOG_FILE:
+        path, inode, gz = files[-1]
+        entry = state.get(str(inode))
+        indexed = entry["offset"] if entry is not None and not entry["gz"] else 0
+        records.extend(tail_records(path, inode, len(files) - 1, indexed, hosts, since, until))
+    records.sort()
+
+    page = []
+    last = None
+    skip = offset
+    for record in records:
+        if record == last:
+            continue
+        last = record
+        if skip:
+            skip -= 1
+            continue
+        page.append(record)
+        if limit is not None and len(page) >= limit:
+            break
+
+    log_lines = []
+    reader = None
+    reader_inode = None
+    try:
+        for pos, member, line_offset, inode in page:
+            if inode != reader_inode:
+                if reader is not None:
+                    reader.close()
+                reader = LogReader(rank[inode][1], rank[inode][2])
+                reader_inode = inode
+            line = reader.line_at(member, line_offset)
+            words = line.split()
+            if len(words) > LOG_SEARCH_COL and words[LOG_SEARCH_COL] in hosts:
+                log_lines.append(line.rstrip())
+    finally:
+        if reader is not None:
+            reader.close()
+    return log_lines
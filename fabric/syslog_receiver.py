@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+'''
+Syslog listener for the switches, run by "manage.py run_syslog_receiver".
+
+Messages come in over UDP and/or TCP (newline or octet counted framing)
+in RFC 3164 or RFC 5424 form and are queued in a SwitchLogStore under the
+sender's HOSTNAME field, which is the serial number until a switch gets its
+configuration. Messages without one are kept under the source address. A
+writer thread flushes the queue every SYSLOG_FLUSH_INTERVAL seconds, or
+sooner once SYSLOG_FLUSH_LINES messages are waiting.
+'''
+
+import re
+import socket
+import SocketServer
+import threading
+import time
+
+from django.conf import settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    SYSLOG_FLUSH_INTERVAL = settings.SYSLOG_FLUSH_INTERVAL
+except AttributeError:
+    SYSLOG_FLUSH_INTERVAL = 1.0
+
+try:
+    SYSLOG_FLUSH_LINES = settings.SYSLOG_FLUSH_LINES
+except AttributeError:
+    SYSLOG_FLUSH_LINES = 10000
+
+MAX_MESSAGE = 65535
+MAX_HOST = 100
+
+PRI_REGEX = re.compile("^<([0-9]{1,3})>")
+RFC3164_REGEX = re.compile("^([A-Z][a-z]{2} +[0-9]{1,2} [0-9]{2}:[0-9]{2}:[0-9]{2}) +(\S+) ?(.*)$", re.S)
+RFC5424_REGEX = re.compile("^1 (\S+) (\S+) (\S+) (\S+) (\S+) ?(.*)$", re.S)
+
+
+def local_stamp(now):
+    tm = time.localtime(now)
+    return time.strftime("%b", tm) + " %2d " % tm.tm_mday + time.strftime("%H:%M:%S", tm)
+
+
+def parse_message(data, address, now):
+    '''
+    (host, line) of one syslog message, line in the host syslog's
+    "Mmm dd hh:mm:ss host message" form.
+    '''
+    data = data.rstrip("\r\n\0").replace("\n", " ")
+    match = PRI_REGEX.match(data)
+    if match is not None:
+        data = data[match.end():]
+
+    stamp = None
+    host = None
+    match = RFC3164_REGEX.match(data)
+    if match is not None:
+        stamp, host, message = match.groups()
+        stamp = re.sub(" +", " ", stamp)
+        if len(stamp) == 14:
+            # "Oct 8 ..." -> "Oct  8 ...", as syslog writes it
+            stamp = stamp[:4] + " " + stamp[4:]
+    else:
+        match = RFC5424_REGEX.match(data)
+        if match is not None:
+            # the receive time is used, it is in the server's zone
+            timestamp, host, app, procid, msgid, message = match.groups()
+            if message.startswith("- "):
+                message = message[2:]
+            if app != "-":
+                message = app + ("[" + procid + "]" if procid != "-" else "") + ": " + message
+        else:
+            message = data
+
+    if not host or host == "-" or len(host) > MAX_HOST:
+        host = address[0]
+    return host, (stamp or local_stamp(now)) + " " + host + " " + message
+
+
+class SyslogTCPHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        receiver = self.server.receiver
+        buf = ""
+        while not receiver.stopping:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            buf += data
+            while buf:
+                if buf[0].isdigit():
+                    # octet counting: "<length> <message>"
+                    space = buf.find(" ")
+                    if space < 0:
+                        break
+                    length = int(buf[:space]) if buf[:space].isdigit() else 0
+                    if length <= 0 or length > MAX_MESSAGE:
+                        logger.error("Bad syslog frame from " + str(self.client_address[0]))
+                        return
+                    if len(buf) < space + 1 + length:
+                        break
+                    message = buf[space + 1:space + 1 + length]
+                    buf = buf[space + 1 + length:]
+                else:
+                    end = buf.find("\n")
+                    if end < 0:
+                        if len(buf) > MAX_MESSAGE:
+                            buf = ""
+                        break
+                    message = buf[:end]
+                    buf = buf[end + 1:]
+                if message.strip():
+                    receiver.receive(message, self.client_address)
+
+
+class SyslogTCPServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SyslogReceiver(object):
+    '''
+    UDP and TCP listeners plus the writer thread of one SwitchLogStore.
+    A port of 0 binds a free port, None doesn't listen on that protocol.
+    '''
+    def __init__(self, store, bind="0.0.0.0", udp_port=514, tcp_port=None,
+                 flush_interval=None, flush_lines=None):
+        self.store = store
+        self.bind = bind
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.flush_interval = flush_interval or SYSLOG_FLUSH_INTERVAL
+        self.flush_lines = flush_lines or SYSLOG_FLUSH_LINES
+        self.stopping = False
+        self.wake = threading.Event()
+        self.udp_sock = None
+        self.tcp_server = None
+        self.threads = []
+
+    def start(self):
+        if self.udp_port is not None:
+            self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                self.udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            except socket.error:
+                pass
+            self.udp_sock.bind((self.bind, self.udp_port))
+            self.udp_sock.settimeout(0.5)
+            self.udp_port = self.udp_sock.getsockname()[1]
+            self.spawn(self.udp_loop, "syslog-udp")
+        if self.tcp_port is not None:
+            self.tcp_server = SyslogTCPServer((self.bind, self.tcp_port), SyslogTCPHandler)
+            self.tcp_server.receiver = self
+            self.tcp_port = self.tcp_server.server_address[1]
+            self.spawn(self.tcp_server.serve_forever, "syslog-tcp")
+        self.spawn(self.writer_loop, "syslog-writer")
+        logger.info("Syslog receiver on " + self.bind + " udp " + str(self.udp_port) +
+                    " tcp " + str(self.tcp_port))
+
+    def spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def stop(self):
+        self.stopping = True
+        if self.tcp_server is not None:
+            self.tcp_server.shutdown()
+            self.tcp_server.server_close()
+        self.wake.set()
+        for thread in self.threads:
+            thread.join()
+        if self.udp_sock is not None:
+            self.udp_sock.close()
+        self.store.flush()
+
+    def receive(self, data, address):
+        host, line = parse_message(data, address, time.time())
+        if self.store.add(host, line) >= self.flush_lines:
+            self.wake.set()
+
+    def udp_loop(self):
+        while not self.stopping:
+            try:
+                data, address = self.udp_sock.recvfrom(MAX_MESSAGE)
+            except socket.timeout:
+                continue
+            except socket.error:
+                if self.stopping:
+                    break
+                raise
+            self.receive(data, address)
+
+    def writer_loop(self):
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.store.flush()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+'''
+Per switch log files written by the syslog receiver (syslog_receiver.py).
+
+Lines are kept in the same "Mmm dd hh:mm:ss host message" form as the host
+syslog, in SYSLOG_STORE_DIR/<hex of host>/<segment>.log. A new segment is
+started once the current one reaches SYSLOG_SEGMENT_SIZE bytes and only
+the newest SYSLOG_SEGMENTS of a switch are kept.
+
+Received lines are queued in memory and written by flush(), one write per
+switch, so the receiver doesn't touch the disk for every message.
+'''
+
+import binascii
+import heapq
+import os
+import re
+import threading
+
+from django.conf import settings
+
+from syslog_index import LineClock
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    SYSLOG_STORE_DIR = settings.SYSLOG_STORE_DIR
+except AttributeError:
+    SYSLOG_STORE_DIR = os.getcwd() + "/switch_logs/"
+
+try:
+    SYSLOG_SEGMENT_SIZE = settings.SYSLOG_SEGMENT_SIZE
+except AttributeError:
+    SYSLOG_SEGMENT_SIZE = 1024 * 1024
+
+try:
+    SYSLOG_SEGMENTS = settings.SYSLOG_SEGMENTS
+except AttributeError:
+    SYSLOG_SEGMENTS = 5
+
+SEGMENT_REGEX = re.compile("^([0-9]+)\.log$")
+
+
+def host_dir(store_dir, host):
+    if isinstance(host, unicode):
+        host = host.encode('utf-8')
+    return os.path.join(store_dir, binascii.hexlify(host))
+
+
+# segment numbers of a switch, oldest first
+def segments(path):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    numbers = []
+    for name in names:
+        match = SEGMENT_REGEX.match(name)
+        if match is not None:
+            numbers.append(int(match.group(1)))
+    numbers.sort()
+    return numbers
+
+
+def segment_path(path, number):
+    return os.path.join(path, "%010d.log" % number)
+
+
+class SwitchLogStore(object):
+    '''
+    Queue of received lines per switch and the writer of their segments.
+    add() is called by the receiver threads, flush() by the writer.
+    '''
+    def __init__(self, store_dir=None, segment_size=None, max_segments=None):
+        self.store_dir = store_dir or SYSLOG_STORE_DIR
+        self.segment_size = segment_size or SYSLOG_SEGMENT_SIZE
+        self.max_segments = max_segments or SYSLOG_SEGMENTS
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pending_count = 0
+        self.written = 0
+        # host -> (segment number, bytes in it), saves a listdir per flush
+        self.current = {}
+
+    def add(self, host, line):
+        with self.lock:
+            self.pending.setdefault(host, []).append(line + "\n")
+            self.pending_count += 1
+            return self.pending_count
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.pending_count = 0
+        for host, lines in pending.iteritems():
+            try:
+                self.write(host, lines)
+            except (IOError, OSError):
+                logger.exception("Unable to write logs of " + host)
+                self.current.pop(host, None)
+                continue
+            self.written += len(lines)
+        return len(pending)
+
+    def write(self, host, lines):
+        path = host_dir(self.store_dir, host)
+        if host not in self.current:
+            numbers = segments(path)
+            if not numbers:
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                numbers = [0]
+            number = numbers[-1]
+            try:
+                size = os.path.getsize(segment_path(path, number))
+            except OSError:
+                size = 0
+            self.current[host] = (number, size)
+        number, size = self.current[host]
+
+        data = "".join(lines)
+        if size and size + len(data) > self.segment_size:
+            number += 1
+            size = 0
+            # retention: drop the oldest segments beyond the limit
+            for old in segments(path)[:-(self.max_segments - 1) or None]:
+                os.unlink(segment_path(path, old))
+        with open(segment_path(path, number), "ab") as fh:
+            fh.write(data)
+        self.current[host] = (number, size + len(data))
+
+
+def has_switch_logs(hosts, store_dir=None):
+    store_dir = store_dir or SYSLOG_STORE_DIR
+    for host in hosts:
+        if host and segments(host_dir(store_dir, host)):
+            return True
+    return False
+
+
+def read_host_lines(store_dir, host):
+    path = host_dir(store_dir, host)
+    clock = LineClock()
+    for number in segments(path):
+        try:
+            fh = open(segment_path(path, number), "rb")
+        except IOError:
+            # removed by retention while being read
+            continue
+        with fh:
+            for line in fh:
+                yield clock.line_time(line), line.rstrip()
+
+
+def read_switch_logs(hosts, since=None, until=None, offset=0, limit=None, store_dir=None):
+    '''
+    Stored lines of any of hosts ordered by time, optionally only those with
+    since <= time < until, paged by offset and limit.
+    '''
+    store_dir = store_dir or SYSLOG_STORE_DIR
+    hosts = sorted(set([host for host in hosts if host]))
+    log_lines = []
+    for ts, line in heapq.merge(*[read_host_lines(store_dir, host) for host in hosts]):
+        if since is not None and ts < since:
+            continue
+        if until is not None and ts >= until:
+            continue
+        if offset:
+            offset -= 1
+            continue
+        if limit is not None and len(log_lines) >= limit:
+            break
+        log_lines.append(line)
+    return log_lines
@@ -1,3 +1,143 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.db import connection
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from unittest import skipUnless
+import json
+import re
+import shutil
+import tempfile
+
+from models import Topology, Fabric, FabricRuleDB, DeployedFabricStats
+from fabric_rule import invalidate_fabric_rule_index
+from configuration import config
+from configuration.models import Configlet, Configuration
+from discoveryrule.models import DiscoveryRule
+from discoveryrule.discoveryrule import invalidate_discovery_rule_set
+from ignite.ignite import process_ignite_batch
+from pool.allocator import invalidate_pool_allocators
+from pool.models import Pool, PoolDetail, PoolFabricDetail
 
 # Create your tests here.
+
+SEQ_SCAN_REGEX = re.compile("Seq Scan on (\w+)")
+
+
+class POAPQueryTest(TestCase):
+    '''
+    Boots switches through process_ignite_batch, half matched by fabric rule
+    and half by serial_id rule, against tables seeded with ROWS rows, and
+    checks the queries the batch issues: a fixed number per switch and, on
+    PostgreSQL, no full scan of a seeded table.
+    '''
+    ROWS = 20000
+    SWITCHES = 10
+    # switch savepoint (2), configuration and configlet (2), global pool
+    # lookup and claim (5), fabric pool lookup, its values and insert (3)
+    QUERIES_PER_SWITCH = 12
+    # topology version
+    QUERIES_PER_NEIGHBOUR_MATCH = 1
+    # fabric and discovery rule versions (2), configuration names (1),
+    # DeployedFabricStats replaced in a savepoint (4). The switches are new,
+    # no reused pool value has its lastmodified written
+    QUERIES_PER_BATCH = 7
+    SEEDED_TABLES = [FabricRuleDB._meta.db_table, DeployedFabricStats._meta.db_table,
+                     DiscoveryRule._meta.db_table, PoolDetail._meta.db_table, PoolFabricDetail._meta.db_table]
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.repo = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.base_path = config.BASE_PATH
+        config.BASE_PATH = self.repo + '/'
+
+        user = User.objects.create(username='poap')
+        configlet = Configlet(name='base', config_type='template', parameters='[]', group='test')
+        configlet.config_path.save('base', ContentFile("hostname $$name$$\nip $$ip$$\nvlan $$vlan$$\n"))
+        pool = Pool.objects.create(name='ip', type='Integer', scope='global', used=self.ROWS,
+                                   available=self.ROWS, range=json.dumps([{'start': 0, 'end': 2 * self.ROWS - 1}]))
+        fabric_pool = Pool.objects.create(name='vlan', type='Vlan', scope='fabric', used=0, available=100,
+                                          range=json.dumps([{'start': 100, 'end': 199}]))
+        cfg = Configuration.objects.create(name='cfg', submit='true', last_modified_by=user, construct_list=[
+            {'configlet_id': configlet.id,
+             'param_list': [{'param_name': 'name', 'param_type': 'Instance', 'param_value': 'SWITCH_NAME'},
+                            {'param_name': 'ip', 'param_type': 'Pool', 'param_value': str(pool.id)},
+                            {'param_name': 'vlan', 'param_type': 'Pool', 'param_value': str(fabric_pool.id)}]}])
+        topology = Topology.objects.create(name='topology', config_json=[], defaults={},
+                                           topology_json={'core_list': [], 'spine_list': [], 'leaf_list': [],
+                                                          'link_list': []})
+        fabric = Fabric.objects.create(name='fabric', config_json=[], system_id=[], topology=topology)
+        rows = range(self.ROWS)
+
+        FabricRuleDB.objects.bulk_create([FabricRuleDB(local_node='fabric_1_leaf' + str(row),
+                                                       remote_node='fabric_1_spine' + str(row),
+                                                       remote_port='Ethernet1/' + str(row),
+                                                       local_port='Ethernet2/' + str(row),
+                                                       fabric=fabric, action=cfg.id, replica_num=1) for row in rows])
+        DeployedFabricStats.objects.bulk_create([DeployedFabricStats(fabric_id=row, replica_num=row,
+                                                                     switch_name='switch' + str(row),
+                                                                     system_id='SAL' + str(row)) for row in rows])
+        DiscoveryRule.objects.bulk_create([DiscoveryRule(name='rule' + str(row), priority=row, fabric_id=-1,
+                                                         config_id=cfg.id, match='serial_id',
+                                                         subrules=['SAL' + str(row)]) for row in rows])
+        PoolDetail.objects.bulk_create([PoolDetail(index=pool, number=row, value=str(row),
+                                                   assigned='switch' + str(row)) for row in rows])
+        PoolFabricDetail.objects.bulk_create([PoolFabricDetail(pool_id=fabric_pool, value=str(row), fab_id=row,
+                                                               assigned='switch' + str(row)) for row in rows])
+        if connection.vendor == 'postgresql':
+            connection.cursor().execute('ANALYZE')
+
+        # bulk_create sends no signals, the caches are dropped by hand
+        invalidate_fabric_rule_index()
+        invalidate_discovery_rule_set()
+        invalidate_pool_allocators()
+
+        # loads the rule index, rule set and pool free list
+        process_ignite_batch([self.poap_info(0), self.poap_info(1)])
+
+    def tearDown(self):
+        config.BASE_PATH = self.base_path
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.repo)
+        invalidate_fabric_rule_index()
+        invalidate_discovery_rule_set()
+        invalidate_pool_allocators()
+
+    # even rows boot by CDP neighbour, odd ones by serial number
+    def poap_info(self, row):
+        if row % 2 == 0:
+            return {'system_id': 'NEW' + str(row),
+                    'neighbor_list': [{'remote_node': 'fabric_1_spine' + str(row),
+                                       'remote_port': 'Ethernet1/' + str(row),
+                                       'local_port': 'Ethernet2/' + str(row)}]}
+        return {'system_id': 'SAL' + str(row), 'neighbor_list': []}
+
+    def boot(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = process_ignite_batch([self.poap_info(row) for row in range(2, 2 + self.SWITCHES)])
+        for result in results:
+            self.assertTrue(result['status'], result)
+        return queries.captured_queries
+
+    def test_query_count(self):
+        queries = self.boot()
+        neighbour_matches = len([row for row in range(2, 2 + self.SWITCHES) if row % 2 == 0])
+        self.assertEqual(len(queries), self.QUERIES_PER_SWITCH * self.SWITCHES +
+                         self.QUERIES_PER_NEIGHBOUR_MATCH * neighbour_matches + self.QUERIES_PER_BATCH,
+                         '\n'.join([query['sql'] for query in queries]))
+
+    @skipUnless(connection.vendor == 'postgresql', "EXPLAIN output checked is PostgreSQL's")
+    def test_index_use(self):
+        cursor = connection.cursor()
+        for query in self.boot():
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            # captured as sent by psycopg2, with the parameters in place
+            cursor.execute('EXPLAIN ' + sql)
+            plan = '\n'.join([row[0] for row in cursor.fetchall()])
+            for table in SEQ_SCAN_REGEX.findall(plan):
+                self.assertNotIn(table, self.SEEDED_TABLES, sql + '\n' + plan)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import re
+import logging
+import threading
+
+from const import *
+from switchdb import TOPOLOGY_LINK_TYPES
+from models import Topology
+logger = logging.getLogger(__name__)
+
+
+#Compiled topologies: topology_id -> TopologyGraph, replaced when updated_date moves
+topology_graph_cache = {}
+topology_graph_lock = threading.Lock()
+
+VPC_LINK_REGEX = re.compile(TOPOLOGY_LINK_TYPES[1])
+
+
+#One switch of the base topology, names are without the <fabric>_<n>_ prefix
+#peers       : [(peer_name, local port list, remote port list)] in link order
+#link_types  : peer_name -> link type of the last link to that peer
+#fabric_ports: local ports of leaf <-> spine links
+#vpc_peer    : last peer whose link type is a VPC link, with its local ports
+class TopologyNode(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.tier = None
+        self.switch_type = None
+        self.peers = []
+        self.link_types = {}
+        self.fabric_ports = []
+        self.vpc_peer = ""
+        self.vpc_localports = []
+
+    def add_peer(self, peer_name, localport_list, remoteport_list, link_type, fabric_link):
+        self.peers.append((peer_name, localport_list, remoteport_list))
+        self.link_types[peer_name] = link_type
+        if fabric_link:
+            self.fabric_ports.extend(localport_list)
+
+    def find_vpc_peer(self):
+        for peer_name, localport_list, remoteport_list in self.peers:
+            if VPC_LINK_REGEX.match(self.link_types[peer_name]):
+                self.vpc_peer = peer_name
+                self.vpc_localports = localport_list
+
+
+class TopologyGraph(object):
+
+    def __init__(self, topology_id, updated_date, topology_info):
+        self.version = (topology_id, updated_date)
+        self.nodes = {}
+
+        tier_names = {}
+        for tier in [CORE_LIST, SPINE_LIST, LEAF_LIST]:
+            tier_names[tier] = set()
+            for switch in topology_info[tier]:
+                node = self.get_node(switch[SWITCH_NAME])
+                node.tier = tier
+                node.switch_type = switch[SWITCH_TYPE]
+                tier_names[tier].add(switch[SWITCH_NAME])
+
+        leaf_names = tier_names[LEAF_LIST]
+        spine_names = tier_names[SPINE_LIST]
+        for link in topology_info[LINK_LIST]:
+            switch1 = link[SWITCH_1]
+            switch2 = link[SWITCH_2]
+            fabric_link = (switch1 in leaf_names and switch2 in spine_names) or\
+                          (switch2 in leaf_names and switch1 in spine_names)
+            self.get_node(switch1).add_peer(switch2, link[PORTLIST_1], link[PORTLIST_2],\
+                                            link[LINK_TYPE], fabric_link)
+            if switch2 != switch1:
+                self.get_node(switch2).add_peer(switch1, link[PORTLIST_2], link[PORTLIST_1],\
+                                                link[LINK_TYPE], fabric_link)
+
+        for node in self.nodes.values():
+            node.find_vpc_peer()
+
+    def get_node(self, name):
+        if name not in self.nodes:
+            self.nodes[name] = TopologyNode(name)
+        return self.nodes[name]
+
+
+#Return the compiled graph of a topology, recompiling only when the row's
+#updated_date differs from the cached one
+def get_topology_graph(topology_id):
+
+    updated_date = Topology.objects.values_list('updated_date', flat = True).get(id = topology_id)
+    graph = topology_graph_cache.get(topology_id)
+    if graph is not None and graph.version == (topology_id, updated_date):
+        return graph
+
+    with topology_graph_lock:
+        graph = topology_graph_cache.get(topology_id)
+        if graph is None or graph.version != (topology_id, updated_date):
+            topology_obj = Topology.objects.get(id = topology_id)
+            graph = TopologyGraph(topology_obj.id, topology_obj.updated_date, topology_obj.topology_json)
+            topology_graph_cache[topology_id] = graph
+            logger.debug("Compiled topology id: " + str(topology_id) + " with " +\
+                         str(len(graph.nodes)) + " switches")
+    return graph
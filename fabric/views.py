@@ -3,13 +3,13 @@ from django.shortcuts import render
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import HttpResponse, Http404, JsonResponse
-from usermanagement.utils import RequestValidator
+from django.db.models import Count
+from usermanagement.utils import RequestValidator, get_usernames, ListRequest, export_response
 from django.contrib.auth.models import User
 import json
 import logging
 import pprint
 import os
-import string
 from django.core.servers.basehttp import FileWrapper
 import re
 from collections import Counter
@@ -23,13 +23,13 @@ from serializer.fabric_serializer import FabricRuleDBGetSerializer
 from serializer.deployed_serializer import DeployedFabricGetSerializer, DeployedFabricDetailGetSerializer
 from configuration.models import Configuration
 from discoveryrule.models import DiscoveryRule
-from fabric.const import INVALID, LOG_SEARCH_COL
+from fabric.const import INVALID
+from syslog_index import read_host_logs
+from syslog_store import has_switch_logs, read_switch_logs
 from discoveryrule.models import DiscoveryRule
 
 logger = logging.getLogger(__name__)
 
-SYSLOG_FILE = "/var/log/syslog"
-
 # Create your views here.
 class JSONResponse(HttpResponse):
     """
@@ -54,16 +54,18 @@ class TopologyList(APIView):
             return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, format=None):
-        topology_list = Topology.objects.filter(status = True).order_by('name')
-        serializer = TopologyGetSerializer(topology_list, many=True)
-        index = 0
-        for item in serializer.data:
+        # the json columns aren't listed, leave them in the DB
+        list_request = ListRequest(request, ('name', 'id'))
+        topology_list = list_request.page(Topology.objects.filter(status = True).order_by('name', 'id')\
+                        .only('id', 'name', 'submit', 'used', 'created_date', 'updated_date', 'user_id'))
+        serializer = list_request.serializer(TopologyGetSerializer(topology_list, many=True))
+        user_names = get_usernames([topology.user_id for topology in topology_list])
+        for topology, item in zip(topology_list, serializer.data):
             try:
-                item['user_name'] = User.objects.get(id=topology_list[index].user_id).username
-            except User.DoesNotExist:
+                item['user_name'] = user_names[topology.user_id]
+            except KeyError:
                 raise Http404
-            index = index + 1
-        return Response(serializer.data)
+        return list_request.response(serializer.data)
 
     def post(self, request, format=None):
         serializer = TopologySerializer(data=request.data)
@@ -109,14 +111,9 @@ class TopologyDetail(APIView):
         topology = self.get_object(id)
         serializer = TopologyGetDetailSerializer(topology)
         topo_detail = serializer.data
-        topo_detail['topology_json'] = json.loads(topo_detail['topology_json'])
-        try:
-            topo_detail['config_json'] = json.loads(topo_detail['config_json'])
-        except:
+        if topo_detail['config_json'] is None:
             topo_detail['config_json'] = []
-        try:
-            topo_detail['defaults'] = json.loads(topo_detail['defaults'])
-        except:
+        if topo_detail['defaults'] is None:
             topo_detail['defaults'] = {}
         return Response(topo_detail)
 
@@ -148,14 +145,9 @@ class TopologyDetail(APIView):
                 topology_obj.save()
                 serailizer = TopologyGetDetailSerializer(topology_obj)
                 resp = serailizer.data
-                resp['topology_json'] = json.loads(resp['topology_json'])
-                try:
-                    resp['config_json'] = json.loads(resp['config_json'])
-                except:
+                if resp['config_json'] is None:
                     resp['config_json'] = []
-                try:
-                    resp['defaults'] = json.loads(resp['defaults'])
-                except:
+                if resp['defaults'] is None:
                     resp['defaults'] = {}
                 return Response(resp)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -184,18 +176,20 @@ class FabricList(APIView):
             return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, format=None):
-        fabric_list = Fabric.objects.filter(status = True).order_by('id')
-        serializer = FabricGetSerializer(fabric_list, many=True)
-        index = 0
-        for item in serializer.data:
-            item['topology_name'] = fabric_list[index].topology.name
-            item['topology_id']  = fabric_list[index].topology.id
+        list_request = ListRequest(request)
+        fabric_list = list_request.page(Fabric.objects.filter(status = True).order_by('id').select_related('topology')\
+                      .only('id', 'name', 'locked', 'submit', 'validate', 'booted', 'instance', 'created_date',\
+                            'updated_date', 'user_id', 'topology', 'topology__name'))
+        serializer = list_request.serializer(FabricGetSerializer(fabric_list, many=True))
+        user_names = get_usernames([fabric.user_id for fabric in fabric_list])
+        for fabric, item in zip(fabric_list, serializer.data):
+            item['topology_name'] = fabric.topology.name
+            item['topology_id']  = fabric.topology_id
             try:
-                item['user_name']   = User.objects.get(id=fabric_list[index].user_id).username
-            except User.DoesNotExist:
+                item['user_name']   = user_names[fabric.user_id]
+            except KeyError:
                 raise Http404
-            index = index + 1
-        return Response(serializer.data)
+        return list_request.response(serializer.data)
 
     def post(self, request, format=None):
         
@@ -204,7 +198,7 @@ class FabricList(APIView):
         resp['Error'] = ' '
         serializer = FabricSerializer(data=request.data)
         topology = Topology.objects.get(id=request.data['topology_id'])
-        topology_json = json.loads(topology.topology_json)
+        topology_json = topology.topology_json
         me = RequestValidator(request.META)
         if serializer.is_valid():
             if request.data['instance'] < 1:
@@ -238,8 +232,8 @@ class FabricList(APIView):
                                 
                 # filling discovery rule with system_id
                 try:
-                    sys_id_obj = json.loads(fabric_obj.system_id)
-                    config_obj = json.loads(fabric_obj.config_json)
+                    sys_id_obj = fabric_obj.system_id
+                    config_obj = fabric_obj.config_json
                     regex  =  fabric_obj.name + "(_)([1-9][0-9]*)(_)([a-zA-Z]*-[1-9])"
                     for switch_systemId_info in sys_id_obj:
                         if not success:
@@ -328,14 +322,12 @@ class FabricDetail(APIView):
         fabric = self.get_object(id)
         serializer = FabricGetDetailSerializer(fabric)
         data = dict(serializer.data)
-        data['config_json'] = json.loads(data['config_json'])
-        data['system_id'] = json.loads(data['system_id'])
         try:
             topology = Topology.objects.get(id=fabric.topology.id)
         except Topology.DoesNotExist:
             raise Http404
         
-        topology_json = json.loads(topology.topology_json)
+        topology_json = topology.topology_json
         topo_detail.update({'topology_name':topology.name})
         topo_detail.update({'topology_id':topology.id})
         topo_detail.update({'topology_json':topology_json})
@@ -358,7 +350,7 @@ class FabricDetail(APIView):
                 +" cannot change base Topology or Fabric Name")
             else:
                 topology = Topology.objects.get(id=request.data['topology_id'])
-                topology_json = json.loads(topology.topology_json)
+                topology_json = topology.topology_json
                 me = RequestValidator(request.META)
                 fabric_obj.user_id = me.user_is_exist().user_id
                 fabric_obj.validate = request.data['validate']
@@ -377,7 +369,7 @@ class FabricDetail(APIView):
                 except:
                     fabric_obj.system_id = []
                     
-                config_in_fabric = json.loads(fabric_obj.config_json)
+                config_in_fabric = fabric_obj.config_json
                 for config in config_in_fabric:
                     config_obj = Configuration.objects.get(id = config['configuration_id'])
                     config_obj.used -= 1
@@ -460,10 +452,7 @@ class FabricDetail(APIView):
                             logger.info("Successfully  update Fabric id: " + str(id))
                             serializer = FabricGetDetailSerializer(fabric_obj)
                             data = serializer.data
-                            data['config_json'] = json.loads(data['config_json'])
-                            try:
-                                data['system_id'] = json.loads(data['system_id'])
-                            except:
+                            if data['system_id'] is None:
                                 data['system_id'] = []
                             for obj in dis_bulkObject_list:
                                 obj.save()
@@ -485,7 +474,7 @@ class FabricDetail(APIView):
     def delete(self, request, id, format=None):
         fabric = self.get_object(id)
         topology = Topology.objects.get(id=fabric.topology.id)
-        config_in_fabric = json.loads(fabric.config_json)
+        config_in_fabric = fabric.config_json
         for config in config_in_fabric:
                     config_obj = Configuration.objects.get(id = config['configuration_id'])
                     config_obj.used -= 1
@@ -517,16 +506,12 @@ class FabricRuleDBDetail(APIView):
             return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, format=None):
-        try:
-            fabricrule_list = FabricRuleDB.objects.filter(status = True).order_by('id')
-        except  FabricRuleDB.DoesNotExist:
-            raise Http404
-        serializer = FabricRuleDBGetSerializer(fabricrule_list, many=True)
-        index = 0
-        for item in serializer.data:
-            item['fabric_id'] = fabricrule_list[index].fabric.id
-            index = index + 1
-        return Response(serializer.data)
+        list_request = ListRequest(request)
+        fabricrule_list = list_request.page(FabricRuleDB.objects.filter(status = True).order_by('id'))
+        serializer = list_request.serializer(FabricRuleDBGetSerializer(fabricrule_list, many=True))
+        for fabricrule, item in zip(fabricrule_list, serializer.data):
+            item['fabric_id'] = fabricrule.fabric_id
+        return list_request.response(serializer.data)
 
     def post(self, request, format=None):
         return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -536,6 +521,32 @@ class FabricRuleDBDetail(APIView):
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+class FabricRuleDBExport(APIView):
+    """
+    Fabric rules streamed as ndjson or csv (?output=), of one fabric with ?fabric_id=
+    """
+    def dispatch(self,request, *args, **kwargs):
+        me = RequestValidator(request.META)
+        if me.user_is_exist():
+            return super(FabricRuleDBExport, self).dispatch(request,*args, **kwargs)
+        else:
+            resp = me.invalid_token()
+            return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
+
+    def get(self, request, format=None):
+        fabricrule_list = FabricRuleDB.objects.filter(status = True)
+        fabric_id = request.query_params.get('fabric_id')
+        if fabric_id:
+            if not fabric_id.isdigit():
+                resp = {}
+                resp["error"] = "Invalid fabric_id"
+                return JsonResponse(resp, status=status.HTTP_400_BAD_REQUEST)
+            fabricrule_list = fabricrule_list.filter(fabric_id = int(fabric_id))
+        return export_response(request, fabricrule_list,
+                               ('id', 'fabric_id', 'replica_num', 'local_node', 'remote_node', 'remote_port',
+                                'local_port', 'action'), 'fabric_rules')
+
+
 class DeployedFabric(APIView):
     """
     GET deployed fabrics
@@ -549,24 +560,27 @@ class DeployedFabric(APIView):
             return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
         
     def get(self, request, format=None):
-        fabric_list = DeployedFabricStats.objects.order_by('fabric_id').distinct('fabric_id')
+        # one row per (fabric, replica) with its boot count, then the names
+        replica_list = DeployedFabricStats.objects.exclude(fabric_id = INVALID).\
+                       values('fabric_id', 'replica_num').annotate(boot_count = Count('id')).\
+                       order_by('fabric_id', 'replica_num')
+        fabric_names = dict(Fabric.objects.filter(id__in = set([replica['fabric_id'] for replica in replica_list])).\
+                            values_list('id', 'name'))
         data = []
-        for fab in fabric_list:
-            try:
-                fabric = Fabric.objects.get(id = fab.fabric_id)
-            except:
-                logger.error("Fabric not found with id: " + str(fab.fabric_id))
-                pass
-            fabric_dict = {}
-            fabric_dict['fabric_id'] = fab.fabric_id
-            if fabric_dict['fabric_id'] != INVALID:
-                fabric_dict['fabric_name'] = fabric.name
-                replica = DeployedFabricStats.objects.order_by('replica_num').\
-                          values_list('replica_num').filter(fabric_id = fab.fabric_id).distinct('replica_num')
-                fabric_dict['total_replicas'] = [tuple[0]for tuple in replica]
+        fabric_dict = None
+        for replica in replica_list:
+            if fabric_dict is None or fabric_dict['fabric_id'] != replica['fabric_id']:
+                fabric_dict = {}
+                fabric_dict['fabric_id'] = replica['fabric_id']
+                if replica['fabric_id'] in fabric_names:
+                    fabric_dict['fabric_name'] = fabric_names[replica['fabric_id']]
+                else:
+                    logger.error("Fabric not found with id: " + str(replica['fabric_id']))
+                fabric_dict['total_replicas'] = []
+                fabric_dict['boot_count'] = 0
                 data.append(fabric_dict)
-            else:
-                pass
+            fabric_dict['total_replicas'].append(replica['replica_num'])
+            fabric_dict['boot_count'] += replica['boot_count']
         serializer = DeployedFabricGetSerializer(data = data, many=True)
         if serializer.is_valid():
             return Response(serializer.data)
@@ -603,18 +617,24 @@ class DeployedFabricDetail(APIView):
         serializer = DeployedFabricDetailGetSerializer(deployed_list, many = True)
         resp = serializer.data
         
+        # names of every configuration / discovery rule on the page at once
+        config_names = dict(Configuration.objects.filter(id__in = set([stat['config_id'] for stat in resp])).\
+                            values_list('id', 'name'))
+        dis_rules = dict([(dis_id, (name, dis_fabric_id)) for dis_id, name, dis_fabric_id in
+                          DiscoveryRule.objects.filter(id__in = set([stat['discoveryrule_id'] for stat in resp])).\
+                          values_list('id', 'name', 'fabric_id')])
         for stat in resp:
-            config = Configuration.objects.get(id = stat['config_id'])
-            stat['config_name'] = config.name
+            if stat['config_id'] in config_names:
+                stat['config_name'] = config_names[stat['config_id']]
             stat['discoveryrule_name'] = ' '
             if stat['discoveryrule_id'] != INVALID:
-                try:
-                    dis_obj = DiscoveryRule.objects.get(id =stat['discoveryrule_id'])
-                except:
+                if stat['discoveryrule_id'] not in dis_rules:
                     logger.error('Discovery rule not found with id:'+str(stat['discoveryrule_id']))
-                if dis_obj.fabric_id != INVALID: 
+                    continue
+                dis_name, dis_fabric_id = dis_rules[stat['discoveryrule_id']]
+                if dis_fabric_id != INVALID: 
                     stat['discoveryrule_id'] = INVALID   
-                stat['discoveryrule_name'] = dis_obj.name
+                stat['discoveryrule_name'] = dis_name
 
         data = {}
         data['fabric.id'] = fabric_id
@@ -676,11 +696,28 @@ class DeployedLogs(APIView):
             resp ={}
             resp["error"] = "Logs not found"
             return JsonResponse(resp, status=status.HTTP_400_BAD_REQUEST)
-        sys_fh = open(SYSLOG_FILE, "r")
-        log_file = []
-        for line in sys_fh:
-            words = line.split()
-            if logs_name.system_id == words[LOG_SEARCH_COL] or logs_name.switch_name == words[LOG_SEARCH_COL]:
-                log_file.append(string.rstrip(line))
-                
+        # optional ?since=&until= (unix time) and ?offset=&limit= paging
+        try:
+            since = request.query_params.get('since')
+            since = float(since) if since else None
+            until = request.query_params.get('until')
+            until = float(until) if until else None
+            offset = int(request.query_params.get('offset') or 0)
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit else None
+        except ValueError:
+            resp = {}
+            resp["error"] = "Invalid since, until, offset or limit"
+            return JsonResponse(resp, status=status.HTTP_400_BAD_REQUEST)
+        if offset < 0 or (limit is not None and limit < 0):
+            resp = {}
+            resp["error"] = "Invalid since, until, offset or limit"
+            return JsonResponse(resp, status=status.HTTP_400_BAD_REQUEST)
+
+        hosts = [logs_name.system_id, logs_name.switch_name]
+        # the switch's own files when it logs to our syslog receiver
+        if has_switch_logs(hosts):
+            log_file = read_switch_logs(hosts, since, until, offset, limit)
+        else:
+            log_file = read_host_logs(hosts, since, until, offset, limit)
         return Response(log_file)
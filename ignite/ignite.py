@@ -1,8 +1,12 @@
+from django.db import transaction
+
 from configuration.config import build_config
-from discoveryrule.discoveryrule import match_discovery_rules 
+from discoveryrule.discoveryrule import match_discovery_rules, get_discovery_rule_set
 from fabric.const import INVALID
-from fabric.fabric_rule import match_fabric_rules 
+from fabric.fabric_rule import match_fabric_rules, get_fabric_rule_index, MatchContext
 from pool.pool import generate_pool_value
+from pool.allocator import flush_pool_allocations, invalidate_pool_allocators
+from pool.allocator import commit_pool_allocations, discard_pool_allocations
 import os
 from fabric.models import DeployedFabricStats, FabricRuleDB, Fabric
 from configuration.models import Configuration
@@ -13,24 +17,67 @@ logger = logging.getLogger(__name__)
 
 
 def process_ignite(info):
+    return process_ignite_batch([info])[0]
+
+
+def process_ignite_batch(info_list):
+    '''
+    POAP for a list of switches. Every switch is matched against the same
+    rule snapshot and runs in its own transaction, so the pools it claims
+    from are only held while that switch is built. DeployedFabricStats is
+    written once at the end. Results are returned in the order of info_list.
+    '''
+    logger.debug("POAP batch of " + str(len(info_list)) + " switches")
+
+    fabric_rule_index = get_fabric_rule_index()
+    discovery_rule_set = get_discovery_rule_set()
+
+    results = []
+    deployed = []
+    for info in info_list:
+        # per switch match state, read back while building the config
+        match_ctx = MatchContext(fabric_rule_index, discovery_rule_set)
+        try:
+            # a switch that blows up does not undo the others
+            with transaction.atomic():
+                result, match_response = process_switch(info, match_ctx)
+            commit_pool_allocations()
+        except Exception:
+            logger.exception("POAP failed for " + str(info.get("system_id")))
+            # pool values claimed by this switch were rolled back with it
+            discard_pool_allocations()
+            flush_pool_allocations()
+            invalidate_pool_allocators()
+            result = {"status": False, "config_filename": "",
+                      "err_msg": "Internal error"}
+            match_response = None
+        if result["status"]:
+            deployed.append((match_response, info["system_id"], result["config_filename"]))
+        results.append(result)
+
+    # lastmodified of the global pool values the batch reused
+    flush_pool_allocations()
+    insert_deployed_fabric_stats(deployed)
+    return results
+
+
+def process_switch(info, match_ctx):
 
     logger.debug("POAP Start")
     logger.debug("Info passed" + str(info))
 
     # init result object
     result = {}
-    result, match_response = match_info(result,info)
+    result, match_response = match_info(result, info, match_ctx)
     
     # id is got from searched in Rules DB; remove this when that function is added
     #cfg_id = 3
 
-    file_name = build_config(match_response["CFG_ID"], match_response["FABRIC_ID"], match_response["SWITCH_ID"])
+    file_name = build_config(match_ctx, match_response["CFG_ID"], match_response["FABRIC_ID"], match_response["SWITCH_ID"])
 
     if file_name == None:
         result["err_msg"] = "Error in Config ID = " + str(match_response["CFG_ID"])
-        return result
-    
-    insert_deployed_fabric_stats(match_response, info["system_id"], file_name)
+        return result, match_response
 
     result["status"] = True
     result["config_filename"] = file_name
@@ -44,9 +91,9 @@ def process_ignite(info):
     
     #clear_repo(result["config_file_loc"])
     
-    return result
+    return result, match_response
 
-def match_info(result,info):
+def match_info(result, info, match_ctx):
     '''
     matching fabric or discovery rules
     '''
@@ -55,12 +102,12 @@ def match_info(result,info):
     result["config_filename"] = ""
 
     # first search in fabric specific ruledb
-    match_response = match_fabric_rules(info)
+    match_response = match_fabric_rules(match_ctx, info)
     
     # if not found, search in global discovery ruledb
     if match_response["CFG_ID"] == INVALID:
         logger.error("No match in Fabric RuleDB")
-        match_response = match_discovery_rules(info)
+        match_response = match_discovery_rules(match_ctx, info)
         
         if match_response["CFG_ID"] == INVALID:
             logger.error("No match in Discovery RuleDB")
@@ -69,25 +116,37 @@ def match_info(result,info):
     return result, match_response
 
 
-def insert_deployed_fabric_stats(match_response, system_id, file_name):
+def insert_deployed_fabric_stats(deployed):
     '''
-    updating DeployedFabricStats on successful CDP request.
+    updating DeployedFabricStats on successful CDP requests.
+    deployed: [(match_response, system_id, file_name)]
     '''
-    
-    DeployedFabricStats.objects.filter(system_id =system_id).delete()
-    deployed_stats = DeployedFabricStats()
-    deployed_stats.fabric_id = match_response["FABRIC_ID"]
-    deployed_stats.replica_num = match_response["REPLICA_NUM"]
-    deployed_stats.switch_name = match_response["SWITCH_ID"]
-    deployed_stats.config_id = match_response["CFG_ID"]
-    deployed_stats.booted = True
-    deployed_stats.config_name =  Configuration.objects.get(id = match_response["CFG_ID"]).name
-    deployed_stats.discoveryrule_id = match_response["DISCOVERYRULE_ID"]
-    deployed_stats.system_id = system_id
-    deployed_stats.match_type = match_response["MATCH_TYPE"]
-    deployed_stats.configuration_generated = file_name
+    if not deployed:
+        return True
+
+    config_names = dict(Configuration.objects.filter(id__in = [match_response["CFG_ID"]
+                                                                for match_response, system_id, file_name in deployed])
+                                             .values_list('id', 'name'))
+    # a switch listed twice keeps its last result, as with single requests
+    stats_by_system_id = {}
+    for match_response, system_id, file_name in deployed:
+        deployed_stats = DeployedFabricStats()
+        deployed_stats.fabric_id = match_response["FABRIC_ID"]
+        deployed_stats.replica_num = match_response["REPLICA_NUM"]
+        deployed_stats.switch_name = match_response["SWITCH_ID"]
+        deployed_stats.config_id = match_response["CFG_ID"]
+        deployed_stats.booted = True
+        deployed_stats.config_name = config_names[match_response["CFG_ID"]]
+        deployed_stats.discoveryrule_id = match_response["DISCOVERYRULE_ID"]
+        deployed_stats.system_id = system_id
+        deployed_stats.match_type = match_response["MATCH_TYPE"]
+        deployed_stats.configuration_generated = file_name
+        stats_by_system_id[system_id] = deployed_stats
+
     try: 
-        deployed_stats.save()
+        with transaction.atomic():
+            DeployedFabricStats.objects.filter(system_id__in = stats_by_system_id.keys()).delete()
+            DeployedFabricStats.objects.bulk_create(stats_by_system_id.values())
         logger.info("DeployedFabricStats DB Updated successfull.")
         return True
     except:
@@ -89,6 +89,9 @@ LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'Asia/Kolkata'
 
+# Zone of the timestamps in the configuration and pool lists
+DISPLAY_TIME_ZONE = 'Asia/Kolkata'
+
 USE_I18N = True
 
 USE_L10N = True
@@ -110,6 +113,23 @@ REST_FRAMEWORK = {
 MEDIA_ROOT = os.path.join(BASE_DIR, 'configlets')
 MEDIA_URL = '/configlets/'
 
+# Store fabric rules once per fabric against base switch names and read the
+# replica number from the neighbour's name at boot. Existing fabrics switch
+# mode when their rules are next regenerated (fabric create/update)
+FABRIC_VIRTUAL_REPLICA_RULES = False
+
+# Switch logs served by deployed/logs, and where their per host offset index
+# is kept (see fabric/syslog_index.py)
+SYSLOG_FILE = "/var/log/syslog"
+SYSLOG_INDEX_DIR = os.path.join(BASE_DIR, 'syslog_index')
+
+# Per switch logs written by "manage.py run_syslog_receiver", preferred over
+# SYSLOG_FILE for switches found there. Every switch keeps at most
+# SYSLOG_SEGMENTS files of SYSLOG_SEGMENT_SIZE bytes
+SYSLOG_STORE_DIR = os.path.join(BASE_DIR, 'switch_logs')
+SYSLOG_SEGMENT_SIZE = 1024 * 1024
+SYSLOG_SEGMENTS = 5
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -9,3 +9,6 @@ class Neighbor(serializers.Serializer):
 class IgniteSerializer(serializers.Serializer):
     system_id = serializers.CharField(required=True, max_length=100)
     neighbor_list = Neighbor(required=True, many=True)
+
+class IgniteBatchSerializer(serializers.Serializer):
+    switches = IgniteSerializer(required=True, many=True)
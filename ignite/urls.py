@@ -3,7 +3,7 @@ __author__  = "Rohit N Dubey"
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
 
-from views import Ignite
+from views import Ignite, IgniteBatch
 
 from . import prod
 
@@ -19,5 +19,6 @@ urlpatterns = patterns('',
     url(r'^api/resource/', include('resource.urls')),
     url(r'^admin/', include(admin.site.urls)),
     url(r'^auth/', include('djoser.urls')),
+    url(r'^api/ignite/batch/?$', IgniteBatch.as_view(), name='batch'),
     url(r'^api/ignite', Ignite.as_view(), name='home'),
 )
@@ -2,8 +2,8 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from serializer import IgniteSerializer
-from ignite import process_ignite
+from serializer import IgniteSerializer, IgniteBatchSerializer
+from ignite import process_ignite, process_ignite_batch
 
 
 class Ignite(APIView):
@@ -18,3 +18,18 @@ class Ignite(APIView):
             return Response(result, status=status.HTTP_201_CREATED)
             
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class IgniteBatch(APIView):
+
+    def post(self, request, format=None):
+        # body is a list of the payloads Ignite takes, one per switch
+        serializer = IgniteBatchSerializer(data={'switches': request.data})
+
+        if serializer.is_valid():
+            # results are in the order of the request
+            results = process_ignite_batch(request.data)
+
+            return Response(results, status=status.HTTP_201_CREATED)
+
+        return Response(serializer.errors['switches'], status=status.HTTP_400_BAD_REQUEST)
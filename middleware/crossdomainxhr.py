@@ -11,6 +11,12 @@ except AttributeError:
     XS_SHARING_ALLOWED_METHODS = ['POST', 'GET', 'OPTIONS', 'PUT', 'DELETE']
     XS_SHARING_ALLOWED_HEADERS = ['Content-Type', '*','Authorization']
     XS_SHARING_ALLOWED_CREDENTIALS = 'true'
+
+# response headers the UI may read, e.g. the list paging cursor
+try:
+    XS_SHARING_EXPOSED_HEADERS = settings.XS_SHARING_EXPOSED_HEADERS
+except AttributeError:
+    XS_SHARING_EXPOSED_HEADERS = ['X-Next-Cursor']
  
  
 class XsSharing(object):
@@ -38,5 +44,6 @@ class XsSharing(object):
         response['Access-Control-Allow-Methods'] = ",".join( XS_SHARING_ALLOWED_METHODS )
         response['Access-Control-Allow-Headers'] = ",".join( XS_SHARING_ALLOWED_HEADERS )
         response['Access-Control-Allow-Credentials'] = XS_SHARING_ALLOWED_CREDENTIALS
+        response['Access-Control-Expose-Headers'] = ",".join( XS_SHARING_EXPOSED_HEADERS )
  
         return response
\ No newline at end of file
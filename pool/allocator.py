@@ -0,0 +1,184 @@
+__author__  = "arunrajms"
+
+import json
+import threading
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from models import Pool
+from models import PoolDetail
+from ranges import PoolRanges, to_value
+
+logger = logging.getLogger(__name__)
+
+# pool id -> PoolAllocator, global pools only. Loaded on first allocation
+# and dropped whenever the Pool row is saved or deleted by anyone else
+pool_allocators = {}
+pool_allocators_lock = threading.Lock()
+
+# (pool id, switch name) -> (PoolAllocator, (id, value)) claimed inside the
+# caller's transaction, per thread. Other threads only see the assignment
+# once commit_pool_allocations has moved it to the allocator
+pending_claims = threading.local()
+
+
+def get_pending_claims():
+    claims = getattr(pending_claims, 'claims', None)
+    if claims is None:
+        claims = pending_claims.claims = {}
+    return claims
+
+
+class PoolAllocator(object):
+    '''
+    In memory view of one global pool. numbers walks the pool's ranges in
+    order and is the free cursor, skipping values that already have a
+    PoolDetail row.
+
+    The view can be stale when other server processes allocate from the same
+    pool, so a value is only handed out once its row is inserted. PoolDetail
+    is unique on (pool, number) and (pool, assigned); an insert that loses a
+    race fails and the next value (or the winner's row for the switch) is
+    used instead. Pool counters are moved by an F() update in the same
+    transaction as the row, so they commit or roll back together with it.
+    The update comes first: it holds the Pool row until the transaction ends,
+    so transactions claiming from one pool queue there rather than on each
+    other's PoolDetail rows. No database call is made under self.lock.
+    A claim made inside the caller's transaction stays with the claiming
+    thread until that transaction is over, see commit_pool_allocations.
+    '''
+    def __init__(self, pool):
+        self.pool_id = pool.id
+        self.lock = threading.Lock()
+        self.numbers = PoolRanges(pool.type, json.loads(pool.range)).numbers()
+        self.allocated = set()
+        self.assigned = {}
+        self.touched = set()
+
+        for id, number, value, assigned in PoolDetail.objects.filter(index=pool.id).order_by('id')\
+                                                     .values_list('id', 'number', 'value', 'assigned'):
+            if number is not None:
+                self.allocated.add(int(number))
+            self.assigned.setdefault(assigned, (id, value))
+
+    def allocate(self, switch_name, touch):
+        while True:
+            with self.lock:
+                if switch_name in self.assigned:
+                    logger.debug("Switch name already exists in pool")
+                    id, value = self.assigned[switch_name]
+                    if touch:
+                        self.touched.add(id)
+                    return value
+                pending = get_pending_claims().get((self.pool_id, switch_name))
+                if pending is not None:
+                    return pending[1][1]
+
+                for number, span in self.numbers:
+                    if number not in self.allocated:
+                        break
+                else:
+                    return None
+                self.allocated.add(number)
+            self.claim(number, span, switch_name)
+
+    def claim(self, number, span, switch_name):
+        value = to_value(number, span)
+        in_transaction = transaction.get_connection().in_atomic_block
+        try:
+            with transaction.atomic():
+                Pool.objects.filter(id=self.pool_id).update(used=F('used') + 1,
+                                                            available=F('available') - 1)
+                pooldetail = PoolDetail.objects.create(index_id=self.pool_id, number=number,
+                                                       prefix_len=span.prefix_len, value=value,
+                                                       assigned=switch_name)
+        except IntegrityError:
+            # the value or the switch was taken by another transaction
+            row = PoolDetail.objects.filter(index=self.pool_id, assigned=switch_name)\
+                                    .values_list('id', 'value').first()
+            if row is not None:
+                logger.debug("Switch name already exists in pool")
+                with self.lock:
+                    self.assigned.setdefault(switch_name, row)
+            return
+        if in_transaction:
+            # rolled back with the caller's transaction if it fails
+            get_pending_claims()[(self.pool_id, switch_name)] = (self, (pooldetail.id, value))
+            return
+        with self.lock:
+            self.assigned.setdefault(switch_name, (pooldetail.id, value))
+
+    def flush(self):
+        with self.lock:
+            touched = self.touched
+            self.touched = set()
+        if touched:
+            PoolDetail.objects.filter(id__in=list(touched)).update(lastmodified=timezone.now())
+
+
+def get_pool_allocator(pool):
+    allocator = pool_allocators.get(pool.id)
+    if allocator is None:
+        with pool_allocators_lock:
+            allocator = pool_allocators.get(pool.id)
+            if allocator is None:
+                allocator = PoolAllocator(pool)
+                pool_allocators[pool.id] = allocator
+                logger.debug("Loaded pool ID: " + str(pool.id) + " with " + str(len(allocator.allocated)) +
+                             " assigned values")
+    return allocator
+
+
+def allocate_pool_value(pool, switch_name, touch=True):
+    return get_pool_allocator(pool).allocate(switch_name, touch)
+
+
+# write lastmodified of reused values back, called once at the end of a POAP batch
+def flush_pool_allocations():
+    for allocator in pool_allocators.values():
+        allocator.flush()
+
+
+# share the values claimed in the transaction that has just committed
+def commit_pool_allocations():
+    claims = get_pending_claims()
+    pending_claims.claims = {}
+    for (pool_id, switch_name), (allocator, row) in claims.items():
+        with allocator.lock:
+            allocator.assigned.setdefault(switch_name, row)
+
+
+# forget the values claimed in the transaction that has just rolled back
+def discard_pool_allocations():
+    pending_claims.claims = {}
+
+
+# forget everything in memory, used when a write-back was rolled back
+def invalidate_pool_allocators():
+    with pool_allocators_lock:
+        pool_allocators.clear()
+
+
+# flush and forget one pool, for changes that bypass Pool.save()
+def drop_pool_allocator(pool_id, flush=True):
+    with pool_allocators_lock:
+        allocator = pool_allocators.pop(pool_id, None)
+    if allocator is not None and flush:
+        allocator.flush()
+
+
+# id of the pool holding the first value assigned to the switch
+def find_assigned_pool(switch_name):
+    return PoolDetail.objects.filter(assigned=str(switch_name)).order_by('id')\
+                             .values_list('index', flat=True).first()
+
+
+@receiver(post_save, sender=Pool)
+@receiver(post_delete, sender=Pool)
+def invalidate_pool_allocator(sender, instance, **kwargs):
+    drop_pool_allocator(instance.id, kwargs.get('signal') is post_save)
@@ -0,0 +1,91 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from netaddr import IPNetwork, AddrFormatError
+
+from pool.models import Pool, PoolDetail
+from pool.ranges import PoolRanges, IP_POOL_TYPES
+
+
+def has_column(table, column):
+    with connection.cursor() as cursor:
+        return column in [description[0] for description in
+                          connection.introspection.get_table_description(cursor, table)]
+
+
+# (number, prefix_len) of a PoolDetail.value, see ranges.to_value
+def value_number(pool_type, value):
+    if pool_type in IP_POOL_TYPES:
+        network = IPNetwork(value)
+        return int(network.ip), network.prefixlen
+    return int(value), None
+
+
+class Command(BaseCommand):
+    help = "Convert PoolDetail of a database created before pools kept only their ranges. " \
+           "Run it before migrate, to drop the rows of free values so the (index, assigned) " \
+           "unique constraint can be added, and again after migrate, to fill in number and " \
+           "prefix_len of the assigned values and count used/available again"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.drop_free_values()
+            self.drop_duplicate_switches()
+            if not has_column(PoolDetail._meta.db_table, 'number'):
+                self.stdout.write("Run migrate, then this command again")
+                return
+            self.fill_numbers()
+            self.count_global_pools()
+
+    # only the columns of the old PoolDetail table are used before migrate
+    def drop_free_values(self):
+        count = PoolDetail.objects.filter(assigned='').count()
+        PoolDetail.objects.filter(assigned='').delete()
+        self.stdout.write("Dropped " + str(count) + " free values")
+
+    # the old allocation used the first row of a switch, the others are left over
+    def drop_duplicate_switches(self):
+        seen = set()
+        duplicates = []
+        for id, index, assigned in PoolDetail.objects.order_by('id').values_list('id', 'index', 'assigned'):
+            if (index, assigned) in seen:
+                duplicates.append(id)
+                self.stdout.write("Pool ID: " + str(index) + " dropping value " + str(id) +
+                                  " held again by " + assigned)
+            seen.add((index, assigned))
+        for start in range(0, len(duplicates), 1000):
+            PoolDetail.objects.filter(id__in=duplicates[start:start + 1000]).delete()
+
+    def fill_numbers(self):
+        for pool in Pool.objects.order_by('id'):
+            taken = set(PoolDetail.objects.filter(index=pool.id, number__isnull=False)
+                                          .values_list('number', flat=True))
+            rows = PoolDetail.objects.filter(index=pool.id, number__isnull=True).order_by('id')\
+                                     .values_list('id', 'value', 'assigned')
+            for id, value, assigned in rows:
+                try:
+                    number, prefix_len = value_number(pool.type, value)
+                except (ValueError, AddrFormatError):
+                    self.stderr.write("Pool ID: " + str(pool.id) + " can't read value " + value +
+                                      " of " + assigned + ", left without a number")
+                    continue
+                if number in taken:
+                    # overlapping ranges gave the value out twice, the switch
+                    # keeps it and the number stays with the first holder
+                    self.stderr.write("Pool ID: " + str(pool.id) + " value " + value + " of " + assigned +
+                                      " is held by another switch too")
+                    continue
+                taken.add(number)
+                PoolDetail.objects.filter(id=id).update(number=number, prefix_len=prefix_len)
+
+    def count_global_pools(self):
+        for pool in Pool.objects.filter(scope='global').order_by('id'):
+            used = PoolDetail.objects.filter(index=pool.id).count()
+            try:
+                size = PoolRanges(pool.type, json.loads(pool.range)).size()
+            except (TypeError, ValueError, KeyError, AddrFormatError):
+                self.stderr.write("Pool ID: " + str(pool.id) + " has no readable range, not counted")
+                continue
+            Pool.objects.filter(id=pool.id).update(used=used, available=size - used)
+            self.stdout.write("Pool ID: " + str(pool.id) + " used " + str(used) + " of " + str(size))
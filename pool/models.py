@@ -10,17 +10,28 @@ class Pool(models.Model):
     name = models.CharField(max_length=100)
     type = models.CharField(max_length=100)
     used = models.IntegerField(default=0)
-    available = models.IntegerField(null=True)
+    # size of the ranges less used, an IPv6 range does not fit an integer
+    available = models.DecimalField(max_digits=39, decimal_places=0, null=True)
     range = models.TextField(null=True)
     scope = models.CharField(max_length=16,default="global")
     
 
+# one row per assigned value of a global pool, free values are only
+# described by Pool.range. number is the value as an integer (IPs included)
 class PoolDetail(models.Model):
 
     index = models.ForeignKey(Pool)
+    number = models.DecimalField(max_digits=39, decimal_places=0, null=True)
+    prefix_len = models.IntegerField(null=True)
     value = models.TextField()
-    assigned = models.TextField()
+    assigned = models.TextField(db_index=True)
     lastmodified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # a value goes to one switch, a switch holds one value per pool.
+        # (index, assigned) also serves the per pool switch lookups and
+        # assigned alone the lookup of a switch's pool for VPC peers
+        unique_together = (('index', 'number'), ('index', 'assigned'))
     
 class PoolFabricDetail(models.Model):
     pool_id = models.ForeignKey(Pool)
@@ -29,4 +40,8 @@ class PoolFabricDetail(models.Model):
     lastmodified = models.DateTimeField(auto_now=True)
     assigned = models.TextField()
 
+    class Meta:
+        # values held by a switch in a fabric / holders of a value in a fabric
+        index_together = (('pool_id', 'fab_id', 'assigned'), ('pool_id', 'fab_id', 'value'))
+
     
@@ -5,6 +5,8 @@ from rest_framework.views import APIView
 from django.views.generic.base import View
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
+from django.db.models import F
 import json
 import re
 import logging
@@ -12,6 +14,8 @@ import logging
 from models import Pool
 from models import PoolDetail
 from models import PoolFabricDetail
+from allocator import allocate_pool_value, find_assigned_pool, drop_pool_allocator
+from ranges import PoolRanges
 
 
 from usermanagement.utils import RequestValidator
@@ -22,7 +26,7 @@ from pprint import *
 
 logger = logging.getLogger(__name__)
 
-def generate_pool_value(pool_id,fabric_id,switch_name,ifvpc=0):
+def generate_pool_value(pool_id,fabric_id,switch_name,ifvpc=0,keep_value=None):
 
     logger.debug("Generating Pool with Pool ID: "+str(pool_id)+" Fabric ID: "+str(fabric_id)+" Switch Name: "+str(switch_name))
     pools = Pool.objects.filter(id=pool_id)
@@ -31,52 +35,25 @@ def generate_pool_value(pool_id,fabric_id,switch_name,ifvpc=0):
     if(pool.scope =='global'):
         logger.debug("Got global pool")
         
-        pooldetails = PoolDetail.objects.filter(index=pool_id,assigned=str(switch_name))
-        
-        if (pooldetails.__len__() == 0 ):
-            if(pool.available==0):
-                logger.error("Pool is FULL!!!")
-                return None
-            
-            pooldetails = PoolDetail.objects.filter(index=pool_id,assigned='')
-            pooldetail = pooldetails.first()
-            pooldetail.assigned = str(switch_name)
-            pooldetail.save()
-            pool.used = pool.used + 1
-            pool.available = pool.available-1
-            pool.save()
-        else:
-            logger.debug("Switch name already exists in pool")
-            pooldetail = pooldetails.first()
-            if ifvpc == 0:
-                pooldetail.save()
-            
-        return pooldetail.value
+        # served from the pool's free list, the row and counters are written as it is claimed
+        value = allocate_pool_value(pool, str(switch_name), ifvpc == 0)
+        if value is None:
+            logger.error("Pool is FULL!!!")
+        return value
         
     elif(pool.scope == 'fabric'):
         
         logger.debug("Got fabric pool")
-        pooldetails = PoolDetail.objects.filter(index=pool_id)
-        poolfabdetails = PoolFabricDetail.objects.filter(pool_id=pool_id,assigned=str(switch_name),fab_id=fabric_id)
-        pool_values = []
-        pool_used_values = []
-        if pooldetails.__len__() - poolfabdetails.__len__() == 0:
+        # value the switch's config was built with last time, if it still holds it
+        if keep_value is not None and PoolRanges(pool.type, json.loads(pool.range)).contains(str(keep_value)) and \
+           PoolFabricDetail.objects.filter(pool_id=pool.id, fab_id=fabric_id, assigned=str(switch_name),
+                                           value=str(keep_value)).exists():
+            return str(keep_value)
+
+        pool_value = lowest_fabric_value(pool, fabric_id, str(switch_name))
+        if pool_value is None:
             logger.error("Exhausted pools")
             return None
-            
-        for pool_det_obj in pooldetails:
-            pool_values.append(pool_det_obj.value)
-            
-        if poolfabdetails.__len__() == 0 :
-            #pool.used = pool.used + 1
-            pool_value = pool_values[0]
-        else:
-            for pool_fab_det_obj in poolfabdetails:
-                pool_used_values.append(pool_fab_det_obj.value)
-                
-            pool_un_used_values = list(set(pool_values)-set(pool_used_values))
-            pool_un_used_values.sort()
-            pool_value = pool_un_used_values[0]
         
         pool_fab_det_obj = PoolFabricDetail()
         pool_fab_det_obj.pool_id = pool
@@ -89,17 +66,25 @@ def generate_pool_value(pool_id,fabric_id,switch_name,ifvpc=0):
         
         
 
+# First value of the pool's ranges the switch doesn't hold yet in the fabric.
+# Its values come from one (pool_id, fab_id, assigned) index scan and the
+# walk stops after at most that many values, so pool size doesn't matter
+def lowest_fabric_value(pool, fabric_id, switch_name):
+    pool_used_values = set(PoolFabricDetail.objects.filter(pool_id=pool.id,fab_id=fabric_id,assigned=switch_name)
+                                                   .values_list('value', flat=True))
+    for value in PoolRanges(pool.type, json.loads(pool.range)).values():
+        if value not in pool_used_values:
+            return value
+    return None
+
+
 def generate_vpc_peer_dest(fabric_id, switch_name,peer_switch_name):
     logger.debug("Generating VPC peer dest with switch name: "+str(switch_name)+" Peer Switch Name: "+str(peer_switch_name))
     
-    pooldetails = PoolDetail.objects.filter(assigned=str(switch_name))
-    
-    for pool_det_obj in pooldetails:
-        pool_id = pool_det_obj.index.id
-        #print pool_id
-        pools = Pool.objects.filter(type='MgmtIP',id=pool_id)
-        if pools.__len__ != 0 :
-            break
+    pool_id = find_assigned_pool(switch_name)
+    if pool_id is None:
+        logger.error("No pool value assigned to switch name: "+str(switch_name))
+        return None
     
     return generate_pool_value(pool_id, fabric_id, peer_switch_name,1)
         
@@ -132,10 +117,14 @@ def delete_switchid_pool(switch_name):
     pools = Pool.objects.filter(scope="global")
     
     for pool_obj in pools:    
-        pooldetails = PoolDetail.objects.filter(index=pool_obj.id,assigned=str(switch_name))
-        for single_obj in pooldetails.iterator():
-            single_obj.assigned=''
-            single_obj.save()
-            pool_obj.used = pool_obj.used - 1
-            pool_obj.available = pool_obj.available + 1
-            pool_obj.save()
+        # only assigned values have rows, freeing one removes it. The rows
+        # are locked so a parallel delete can't make the counters drift
+        with transaction.atomic():
+            ids = list(PoolDetail.objects.select_for_update().filter(index=pool_obj.id,assigned=str(switch_name))
+                                         .values_list('id', flat=True))
+            if ids:
+                PoolDetail.objects.filter(id__in=ids).delete()
+                Pool.objects.filter(id=pool_obj.id).update(used=F('used') - len(ids),
+                                                           available=F('available') + len(ids))
+        if ids:
+            drop_pool_allocator(pool_obj.id)
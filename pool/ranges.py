@@ -0,0 +1,63 @@
+__author__  = "arunrajms"
+
+from collections import namedtuple
+from netaddr import IPAddress, IPNetwork
+
+IP_POOL_TYPES = ['IP', 'MgmtIP', 'IPv6']
+
+# one {start, end} entry of Pool.range as integers. prefix_len and version
+# are None for Integer/Vlan/AutoGenerate pools
+PoolSpan = namedtuple('PoolSpan', ['first', 'last', 'prefix_len', 'version'])
+
+
+class PoolRanges(object):
+    '''
+    Values of a pool worked out from its Pool.range list instead of one
+    PoolDetail row per value. Values are ordered as the ranges are listed,
+    which is the order the old per value rows were created in.
+    '''
+    def __init__(self, pool_type, range_list):
+        self.spans = []
+        for pool_range in range_list:
+            if pool_type in IP_POOL_TYPES:
+                start = IPNetwork(str(pool_range['start']))
+                end = IPNetwork(str(pool_range['end']))
+                self.spans.append(PoolSpan(int(start.ip), int(end.ip), start.prefixlen, start.version))
+            else:
+                self.spans.append(PoolSpan(int(pool_range['start']), int(pool_range['end']), None, None))
+
+    def size(self):
+        return sum([max(span.last - span.first + 1, 0) for span in self.spans])
+
+    # (number, span) for every value; a loop as xrange can't hold IPv6 numbers
+    def numbers(self):
+        for span in self.spans:
+            number = span.first
+            while number <= span.last:
+                yield number, span
+                number += 1
+
+    def values(self):
+        for number, span in self.numbers():
+            yield to_value(number, span)
+
+    # value, in the text form of to_value, lies in one of the ranges
+    def contains(self, value):
+        for span in self.spans:
+            if span.version is None:
+                number = int(value)
+            else:
+                network = IPNetwork(value)
+                if (network.version, network.prefixlen) != (span.version, span.prefix_len):
+                    continue
+                number = int(network.ip)
+            if span.first <= number <= span.last:
+                return True
+        return False
+
+
+# text form stored in PoolDetail.value, e.g. "10" or "10.1.1.5/24"
+def to_value(number, span):
+    if span.version is None:
+        return str(number)
+    return str(IPAddress(number, span.version)) + "/" + str(span.prefix_len)
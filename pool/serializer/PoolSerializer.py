@@ -3,6 +3,7 @@ __author__ = "arunrajms"
 from rest_framework import serializers
 from pool.models import Pool
 from rest_framework.validators import UniqueValidator
+from usermanagement.utils import LocalDateTimeField
 import re
 
 TYPE_CHOICES = ['Integer','IP','IPv6','AutoGenerate','Vlan','MgmtIP']
@@ -52,7 +53,7 @@ class PoolGetDetailSerializer(serializers.Serializer):
 
     value = serializers.CharField(max_length=100)
     assigned = serializers.CharField(max_length=100,required=False)
-    lastmodified = serializers.CharField(max_length=100)
+    lastmodified = LocalDateTimeField()
     
 class PoolPutSerializer(serializers.Serializer):
 
@@ -1,3 +1,81 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.db import connection, transaction
+import json
+import threading
+
+from models import Pool, PoolDetail
+from allocator import PoolAllocator, commit_pool_allocations
 
 # Create your tests here.
+
+
+class PoolAllocatorStressTest(TransactionTestCase):
+    '''
+    Threads stand in for requests booting the same switches from one pool in
+    parallel and, like a POAP batch, each claims inside its own transaction.
+    They share one allocator as requests of one server process do, or have
+    one each as separate server processes do.
+    '''
+    THREADS = 8
+    SWITCHES = 50
+    SIZE = 200
+
+    def setUp(self):
+        self.pool = Pool.objects.create(name='stress', type='Integer', scope='global',
+                                        range=json.dumps([{'start': 1, 'end': self.SIZE}]),
+                                        used=0, available=self.SIZE)
+
+    def boot(self, allocator, thread_num, results, errors):
+        try:
+            if allocator is None:
+                allocator = PoolAllocator(Pool.objects.get(id=self.pool.id))
+            with transaction.atomic():
+                # every thread walks the switches from a different starting point
+                for index in range(self.SWITCHES):
+                    switch_name = 'switch_' + str((index + thread_num * 7) % self.SWITCHES)
+                    results.append((switch_name, allocator.allocate(switch_name, True)))
+                allocator.flush()
+            commit_pool_allocations()
+        except Exception, e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def run_threads(self, shared):
+        results = []
+        errors = []
+        allocator = None
+        if shared:
+            allocator = PoolAllocator(Pool.objects.get(id=self.pool.id))
+        threads = [threading.Thread(target=self.boot, args=(allocator, thread_num, results, errors))
+                   for thread_num in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.THREADS * self.SWITCHES)
+
+        # every thread got the same value for a switch, no value went twice
+        values = {}
+        for switch_name, value in results:
+            self.assertIsNotNone(value)
+            self.assertEqual(values.setdefault(switch_name, value), value)
+        self.assertEqual(len(set(values.values())), self.SWITCHES)
+
+        rows = PoolDetail.objects.filter(index=self.pool.id)
+        self.assertEqual(rows.count(), self.SWITCHES)
+        self.assertEqual(dict(rows.values_list('assigned', 'value')), values)
+
+        pool = Pool.objects.get(id=self.pool.id)
+        self.assertEqual(pool.used, rows.count())
+        self.assertEqual(pool.available, self.SIZE - rows.count())
+
+    def test_shared_allocator(self):
+        self.run_threads(True)
+
+    # allocators that don't see each other's claims race on the PoolDetail
+    # unique constraints
+    def test_allocator_per_process(self):
+        self.run_threads(False)
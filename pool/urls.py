@@ -5,8 +5,10 @@ from django.contrib import admin
 from django.views.decorators.csrf import csrf_exempt
 from views import PoolList
 from views import PoolDetailList
+from views import PoolDetailExport
 
 urlpatterns = patterns('',
     url(r'^$',PoolList.as_view(),name='Full_Pools'),
     url(r'^(?P<id>\w+)/$',PoolDetailList.as_view(),name='Full_Pools'),
+    url(r'^(?P<id>\w+)/export/$',PoolDetailExport.as_view(),name='Pool_Export'),
 )
@@ -1,5 +1,6 @@
 __author__  = "arunrajms"
 from django.db import transaction
+from django.db.models import F
 
 from django.shortcuts import render
 from rest_framework.views import APIView
@@ -11,13 +12,15 @@ import json
 import logging
 
 from models import Pool,PoolDetail,PoolFabricDetail
+from ranges import PoolRanges
+from allocator import drop_pool_allocator
 from serializer.PoolSerializer import PoolSerializer
 from serializer.PoolSerializer import PoolGetSerializer
 from serializer.PoolSerializer import PoolGetDetailSerializer
 from serializer.PoolSerializer import PoolPutSerializer
 
 
-from usermanagement.utils import RequestValidator, change_datetime
+from usermanagement.utils import RequestValidator, ListRequest, export_response
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 
@@ -39,11 +42,13 @@ class PoolList(APIView):
             
             
     def get(self, request, format=None):
-        pool = Pool.objects.all()
-        serializer = PoolGetSerializer(pool, many=True)
+        list_request = ListRequest(request)
+        pool = list_request.page(list_request.defer(Pool.objects.order_by('id'), 'range'))
+        serializer = list_request.serializer(PoolGetSerializer(pool, many=True))
         for single_obj in serializer.data:
-            single_obj['range'] =  json.loads(single_obj['range'])
-        return Response(serializer.data)
+            if 'range' in single_obj:
+                single_obj['range'] =  json.loads(single_obj['range'])
+        return list_request.response(serializer.data)
         
 
     @transaction.atomic
@@ -55,60 +60,20 @@ class PoolList(APIView):
             col_object.type = serializer.data['type']
             col_object.name = serializer.data['name']
             col_object.scope = serializer.data['scope']
-            col_object.save()
             
             type = serializer.data['type']
             coll_range=[{'start':0,'end':1}]
             if type == 'AutoGenerate':
-                start = 10
-                end = 20
-                for flag in range(start,end + 1):
-                    coll = PoolDetail()
-                    coll.index = col_object
-                    coll.value = flag
-                    coll.save()
-                coll_range[0]['start'] = start
-                coll_range[0]['end'] = end
-                col_object.range = json.dumps(coll_range)
+                coll_range[0]['start'] = 10
+                coll_range[0]['end'] = 20
             else:
-                col_object.range = json.dumps(serializer.data['range'])
-            col_object.save()
-
+                coll_range = serializer.data['range']
+            col_object.range = json.dumps(coll_range)
             
-            if type == 'Integer' or type =='Vlan':
-                for i in range(0,len(serializer.data['range'])):
-                    start = int(serializer.data['range'][i]['start'])
-                    end = int(serializer.data['range'][i]['end'])
-                    for flag in range(start,end + 1):
-                        coll = PoolDetail()
-                        coll.index = col_object
-                        coll.value = flag
-                        coll.save()
-                    
-            if type == 'IP' or type == 'MgmtIP' or type == 'IPv6':
-                for i in range(0,len(serializer.data['range'])):
-                    start_ip = IPNetwork(str(serializer.data['range'][i]['start']))
-                    end_ip = IPNetwork(str(serializer.data['range'][i]['end']))
-                    for ip_val in range (start_ip.ip,end_ip.ip+1):
-                        coll = PoolDetail()
-                        coll.index = col_object
-                        coll.value = IPAddress(ip_val).__str__()+"/"+start_ip.prefixlen.__str__()
-                        coll.save()
-                    
-        
-        #    if type == 'IPv6':
-        #        start_ip = IPNetwork(str(serializer.data['range'][0]['start']))
-        #        end_ip = IPNetwork(str(serializer.data['range'][0]['end']))
-        #        for ip_val in range (start_ip.ip,end_ip.ip+1):
-        #            coll = PoolDetail()
-        #            coll.index = col_object
-        #            coll.value = IPAddress(ip_val).__str__()+"/"+start_ip.prefixlen.__str__()
-        #            coll.save()
-                    
-            get_coll_detail = PoolDetail.objects.filter(index = col_object.id,assigned ='')
-            available = len(get_coll_detail)
-            col_object.available = available
-            col_object.used = len(PoolDetail.objects.filter(index = col_object.id)) - available
+            # only the ranges are stored, PoolDetail rows are created as
+            # values get assigned
+            col_object.used = 0
+            col_object.available = PoolRanges(type, coll_range).size()
             col_object.save()
             serializer = PoolGetSerializer(col_object)
             collect_details = serializer.data
@@ -144,17 +109,18 @@ class PoolDetailList(APIView):
         collect_details = serializer.data
         collect_details['range'] = json.loads(collect_details['range'])
         #available_data = PoolDetail.objects.filter(index = id,assigned ='')
-        used_data = PoolDetail.objects.filter(index = id).exclude(assigned = '')
+        # used_data is the paged list, ?fields= picks its keys
+        list_request = ListRequest(request)
+        used_data = list_request.page(PoolDetail.objects.filter(index = id).exclude(assigned = '').order_by('id'))
         #serializer = PoolGetDetailSerializer(available_data,many=True)
         #collect_details['available_data'] = serializer.data
-        serializer = PoolGetDetailSerializer(used_data,many=True)
+        serializer = list_request.serializer(PoolGetDetailSerializer(used_data,many=True))
 
 
 	collec = serializer.data
-	collec = change_datetime(collec)
-        collect_details['used_data'] = collec #serializer.data        
+        collect_details['used_data'] = list_request.project(collec) #serializer.data        
         #collect_details['available'] = available_data
-        return Response(collect_details)
+        return list_request.response(collect_details)
         
     def put(self,request,id,format=None):
         col_object = self.get_object(id)
@@ -178,50 +144,21 @@ class PoolDetailList(APIView):
             if type == 'AutoGenerate':
                 return Response(status=status.HTTP_400_BAD_REQUEST)
             
-            if type == 'Integer' or type =='Vlan':
-                for i in range(0,len(serializer.data['range'])):
-                    start = int(serializer.data['range'][i]['start'])
-                    end = int(serializer.data['range'][i]['end'])
-                    diff = end - start
-                
-                    for flag in range(start,end + 1):
-                        coll = PoolDetail()
-                        coll.index = col_object
-                        coll.value = flag
-                        coll.save()
-                    
-                    collect_details['range'].append(serializer.data['range'][i])
-                    col_object.available = int(col_object.available) + diff + 1
-                    
-                col_object.range = json.dumps(collect_details['range'])
-                col_object.save()
+            if type == 'Integer' or type =='Vlan' or type =='IP' or type =='MgmtIP' or type =='IPv6':
+                collect_details['range'].extend(serializer.data['range'])
+                # used values keep their rows, the rest of the ranges is free.
+                # used is read in the UPDATE so parallel allocations still add up
+                size = PoolRanges(col_object.type, collect_details['range']).size()
+                Pool.objects.filter(id=col_object.id).update(name=col_object.name,
+                                                             range=json.dumps(collect_details['range']),
+                                                             available=size - F('used'))
+                drop_pool_allocator(col_object.id)
+                col_object = self.get_object(id)
                 
                 serializer = PoolGetSerializer(col_object)
                 collect_details = serializer.data
                 collect_details['range'] = json.loads(collect_details['range'])
                 return Response(collect_details, status=status.HTTP_206_PARTIAL_CONTENT)
-            
-            if type =='IP' or type =='MgmtIP' or type =='IPv6':
-                for i in range(0,len(serializer.data['range'])):
-                    start_ip = IPNetwork(str(serializer.data['range'][0]['start']))
-                    end_ip = IPNetwork(str(serializer.data['range'][0]['end']))
-
-                    for ip_val in range (start_ip.ip,end_ip.ip+1):
-                        coll = PoolDetail()
-                        coll.index = col_object
-                        coll.value = IPAddress(ip_val).__str__()+"/"+start_ip.prefixlen.__str__()
-                        coll.save()
-                        
-                    diff = int(end_ip.ip-start_ip.ip) + 1
-                    collect_details['range'].append(serializer.data['range'][i])
-                    col_object.available = int(col_object.available) + diff
-                    
-                col_object.range = json.dumps(collect_details['range'])
-                col_object.save()
-                serializer = PoolGetSerializer(col_object)
-                collect_details = serializer.data
-                collect_details['range'] = json.loads(collect_details['range'])
-                return Response(collect_details, status=status.HTTP_206_PARTIAL_CONTENT)
            
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -238,8 +175,32 @@ class PoolDetailList(APIView):
                 return Response(status=status.HTTP_400_BAD_REQUEST)
         elif pool.scope == 'fabric':
             collec_fab_details = PoolFabricDetail.objects.filter(pool_id=id)
-            if collec_fab_details.__len__() == 0:
+            if not collec_fab_details.exists():
                 pool.delete()
                 return Response(status=status.HTTP_204_NO_CONTENT)
             else:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+class PoolDetailExport(APIView):
+    '''
+    Assigned values of a pool streamed as ndjson or csv (?output=)
+    '''
+    def dispatch(self,request, *args, **kwargs):
+        me = RequestValidator(request.META)
+        if me.user_is_exist():
+            return super(PoolDetailExport, self).dispatch(request,*args, **kwargs)
+        else:
+            resp = me.invalid_token()
+            return JsonResponse(resp,status=status.HTTP_400_BAD_REQUEST)
+
+    def get(self,request,id,format=None):
+        try:
+            pool = Pool.objects.get(pk=id)
+        except Pool.DoesNotExist:
+            raise Http404
+        if pool.scope == 'fabric':
+            return export_response(request, PoolFabricDetail.objects.filter(pool_id=pool.id),
+                                   ('id', 'fab_id', 'value', 'assigned', 'lastmodified'), 'pool_' + str(pool.id))
+        return export_response(request, PoolDetail.objects.filter(index=pool.id).exclude(assigned=''),
+                               ('id', 'value', 'assigned', 'lastmodified'), 'pool_' + str(pool.id))
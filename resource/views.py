@@ -14,7 +14,7 @@ from models import Switch
 from serializer.SwitchSerializer import SwitchSerializer
 from serializer.SwitchSerializer import SwitchGetSerializer
 
-from usermanagement.utils import RequestValidator
+from usermanagement.utils import RequestValidator, ListRequest
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 
@@ -36,9 +36,10 @@ class SwitchList(APIView):
             
             
     def get(self, request, format=None):
-        switch = Switch.objects.all()
-        serializer = SwitchGetSerializer(switch, many=True)
-        return Response(serializer.data)
+        list_request = ListRequest(request)
+        switch = list_request.page(Switch.objects.order_by('id'))
+        serializer = list_request.serializer(SwitchGetSerializer(switch, many=True))
+        return list_request.response(serializer.data)
         
 
     @transaction.atomic
@@ -0,0 +1,69 @@
+__author__  = "Rohit N Dubey"
+
+import ast
+import json
+
+from django.db import models
+
+
+class JSONDescriptor(object):
+    '''
+    Keeps the column value as loaded or assigned and parses it the first
+    time it is read, once per instance. Assigning drops the parsed value.
+    '''
+    def __init__(self, field):
+        self.field = field
+        self.cache_name = '_' + field.attname + '_parsed'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        data = instance.__dict__
+        if self.cache_name not in data:
+            data[self.cache_name] = self.field.parse(data.get(self.field.attname))
+        return data[self.cache_name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+        instance.__dict__.pop(self.cache_name, None)
+
+
+class JSONField(models.TextField):
+    '''
+    Text column holding JSON, read as the parsed object. A string assigned
+    to it is taken as JSON text and saved as it is, anything else is dumped
+    on save. The column stays text on every backend: older rows hold str()
+    of a list, which jsonb won't take, and values() gives the same strings
+    everywhere.
+    '''
+    def contribute_to_class(self, cls, name):
+        super(JSONField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, JSONDescriptor(self))
+
+    def parse(self, value):
+        if not isinstance(value, basestring):
+            # assigned as an object
+            return value
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            # rows saved as str() of a list before the field was JSON
+            return ast.literal_eval(value)
+
+    def pre_save(self, model_instance, add):
+        data = model_instance.__dict__
+        cache_name = '_' + self.attname + '_parsed'
+        if data.get(cache_name) is not None:
+            # may have been changed in place
+            return data[cache_name]
+        return data.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, basestring):
+            return value
+        return json.dumps(value)
+
+    def value_to_string(self, obj):
+        return self.get_prep_value(self.pre_save(obj, False))
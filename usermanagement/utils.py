@@ -1,12 +1,84 @@
 __author__  = "Rohit N Dubey"
 
+from rest_framework import serializers
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from collections import OrderedDict
+import base64
+import csv
+import datetime
+import json
+import threading
+import time
 import logging
 logger = logging.getLogger(__name__)
 import re
 import pytz
-from dateutil.parser import parse  
+from StringIO import StringIO
+
+#Configlet parameter placeholder: $$name$$
+PARAM_REGEX = re.compile('\$\$([0-9a-zA-Z_]+)\$\$')
+
+#Zone and format of the timestamps shown in the UI lists
+try:
+    DISPLAY_TIME_ZONE = pytz.timezone(settings.DISPLAY_TIME_ZONE)
+except AttributeError:
+    DISPLAY_TIME_ZONE = pytz.timezone(settings.TIME_ZONE)
+DISPLAY_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#Token key -> (Token with its user loaded, expiry time), least recently used
+#first. Entries are dropped when the token is deleted (djoser logout) or its
+#user changes, and expire after TOKEN_CACHE_TTL seconds for changes made by
+#other server processes
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE_TTL = 60
+token_cache = OrderedDict()
+token_cache_lock = threading.Lock()
+
+
+def get_cached_token(key):
+    now = time.time()
+    with token_cache_lock:
+        entry = token_cache.pop(key, None)
+        if entry is not None and entry[1] > now:
+            token_cache[key] = entry
+            return entry[0]
+
+    try:
+        token = Token.objects.select_related('user').get(key = key)
+    except Token.DoesNotExist:
+        return None
+
+    with token_cache_lock:
+        token_cache[key] = (token, now + TOKEN_CACHE_TTL)
+        while len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last = False)
+    return token
+
+
+@receiver(post_delete, sender=Token)
+def evict_token(sender, instance, **kwargs):
+    with token_cache_lock:
+        token_cache.pop(instance.key, None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user_tokens(sender, instance, **kwargs):
+    with token_cache_lock:
+        for key, entry in token_cache.items():
+            if entry[0].user_id == instance.id:
+                del token_cache[key]
+
 
 class RequestValidator(object):
 
@@ -21,7 +93,7 @@ class RequestValidator(object):
         try:
             self.auth_key = self.meta_obj['HTTP_AUTHORIZATION']
             logger.debug("Authorization key: "+str(self.auth_key))
-            self.get_token = Token.objects.get(key = self.auth_key)
+            self.get_token = get_cached_token(self.auth_key)
         except:
             self.get_token = None
             logger.error("Not a valid authorization key")
@@ -33,35 +105,191 @@ class RequestValidator(object):
         return resp
 
 
+def get_usernames(user_ids):
+    '''
+    user id -> username for all the ids in one query
+    '''
+    return dict(User.objects.filter(id__in = set(user_ids)).values_list('id', 'username'))
+
+
+#List GET parameters, all optional:
+#  ?fields=id,name   only these keys of every item
+#  ?limit=n          n items, the cursor of the next page is sent in the
+#  ?cursor=c         X-Next-Cursor header when there is one
+#Without limit and cursor the whole list is returned
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+LIST_LIMIT_MAX = 1000
+
+
+class ListRequest(object):
+    '''
+    Keyset paging and field projection of a list GET. ordering is the
+    order_by of the list and has to end with a unique field; a page starts
+    after the ordering values of the last item of the page before, so pages
+    stay cheap and stable however deep the client goes.
+    '''
+    def __init__(self, request, ordering=('id',)):
+        self.ordering = ordering
+        self.next_cursor = None
+        fields = request.query_params.get('fields')
+        self.fields = [field for field in fields.split(',') if field] if fields else None
+        try:
+            limit = request.query_params.get('limit')
+            self.limit = int(limit) if limit else None
+            cursor = request.query_params.get('cursor')
+            self.cursor = json.loads(base64.urlsafe_b64decode(str(cursor))) if cursor else None
+        except (ValueError, TypeError):
+            raise ParseError("Invalid limit or cursor")
+        if self.limit is not None and not 0 < self.limit <= LIST_LIMIT_MAX:
+            raise ParseError("limit has to be between 1 and " + str(LIST_LIMIT_MAX))
+        if self.cursor is not None:
+            if not isinstance(self.cursor, list) or len(self.cursor) != len(ordering):
+                raise ParseError("Invalid limit or cursor")
+            if self.limit is None:
+                self.limit = LIST_LIMIT_MAX
+
+    def wants(self, field):
+        return self.fields is None or field in self.fields
+
+    def defer(self, queryset, *fields):
+        '''
+        leave the given (large) columns in the DB unless they are asked for
+        '''
+        deferred = [field for field in fields if not self.wants(field)]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
+
+    def serializer(self, serializer):
+        '''
+        drop the fields that weren't asked for, so deferred columns aren't read
+        '''
+        fields = getattr(serializer, 'child', serializer).fields
+        for field in fields.keys():
+            if not self.wants(field):
+                fields.pop(field)
+        return serializer
+
+    def page(self, queryset):
+        '''
+        items of the requested page of queryset, ordered by self.ordering
+        '''
+        if self.cursor is not None:
+            after = None
+            for pos, field in enumerate(self.ordering):
+                cond = Q(**{field + '__gt': self.cursor[pos]})
+                for prev, prev_field in enumerate(self.ordering[:pos]):
+                    cond &= Q(**{prev_field: self.cursor[prev]})
+                after = cond if after is None else after | cond
+            queryset = queryset.filter(after)
+        if self.limit is None:
+            return list(queryset)
+        items = list(queryset[:self.limit + 1])
+        if len(items) > self.limit:
+            items = items[:self.limit]
+            last = [getattr(items[-1], field) for field in self.ordering]
+            self.next_cursor = base64.urlsafe_b64encode(json.dumps(last))
+        return items
+
+    def project(self, data):
+        if self.fields is None or not isinstance(data, list):
+            return data
+        return [OrderedDict([(key, value) for key, value in item.items() if key in self.fields])
+                for item in data]
+
+    def response(self, data, status=None):
+        response = Response(self.project(data), status=status)
+        if self.next_cursor is not None:
+            response[NEXT_CURSOR_HEADER] = self.next_cursor
+        return response
+
+
+
+#Streamed exports: ?output=ndjson (default) or csv. Rows are read
+#EXPORT_BATCH_SIZE at a time after the last id sent, one batch is held in
+#memory whatever the table size
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def iter_batches(queryset, fields, batch_size=EXPORT_BATCH_SIZE):
+    '''
+    values_list batches of queryset in id order, fields[0] has to be 'id'
+    '''
+    last_id = None
+    while True:
+        batch = queryset.order_by('id')
+        if last_id is not None:
+            batch = batch.filter(id__gt = last_id)
+        rows = list(batch.values_list(*fields)[:batch_size])
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+def export_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def export_rows(fields, batches, output):
+    '''
+    the export as one string per batch
+    '''
+    if output == 'csv':
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+        for rows in batches:
+            for row in rows:
+                writer.writerow([export_value(value) for value in row])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    else:
+        encoder = DjangoJSONEncoder()
+        for rows in batches:
+            yield "".join([encoder.encode(OrderedDict(zip(fields, row))) + "\n" for row in rows])
+
+
+def export_response(request, queryset, fields, filename):
+    output = request.query_params.get('output') or 'ndjson'
+    if output not in EXPORT_CONTENT_TYPES:
+        raise ParseError("output has to be one of " + ", ".join(sorted(EXPORT_CONTENT_TYPES)))
+    response = StreamingHttpResponse(export_rows(fields, iter_batches(queryset, fields), output),
+                                     content_type = EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = 'attachment; filename="' + filename + '.' + output + '"'
+    return response
+
+
 def parse_file(file_content):
 
     param_list = []
-    get_parameter_list = re.findall('\$\$[0-9a-zA-Z_]+\$\$',file_content)
+    get_parameter_list = PARAM_REGEX.findall(file_content)
     for one_param in get_parameter_list:
-        one_param = one_param.strip('$$')
         if one_param not in param_list:
             param_list.append(one_param)
     return param_list
 
 
-def change_datetime(collec):
+class LocalDateTimeField(serializers.DateTimeField):
     '''
-	Accept a orderded list of dict change lastmodified param
+    Read only timestamp as "YYYY-MM-DD HH:MM:SS" in DISPLAY_TIME_ZONE
     '''
-    for coll  in collec:
-        for k,v in coll.items():
-            if k == 'lastmodified' and v:
-                dt = parse(v)
-                localtime =  dt.astimezone (pytz.timezone('Asia/Kolkata'))
-                coll[k] =  localtime.strftime ("%Y-%m-%d %H:%M:%S")
-	
-            if k == 'created_date' and v:
-                dt = parse(v)
-                localtime =  dt.astimezone (pytz.timezone('Asia/Kolkata'))
-                coll[k] =  localtime.strftime ("%Y-%m-%d %H:%M:%S")
-
-            if k == 'updated_date' and v:
-                dt = parse(v)
-                localtime =  dt.astimezone (pytz.timezone('Asia/Kolkata'))
-                coll[k] =  localtime.strftime ("%Y-%m-%d %H:%M:%S")
-    return collec
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super(LocalDateTimeField, self).__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return value
+        if value.tzinfo is None:
+            value = pytz.utc.localize(value)
+        return value.astimezone(DISPLAY_TIME_ZONE).strftime(DISPLAY_DATETIME_FORMAT)